@@ -2,8 +2,82 @@ import sys
 import os
 import enum
 import socket
+import select
+import asyncio
+import threading
+import time
+import queue
+import mmap
+import fcntl
+import random
+import hashlib
+import bisect
+import itertools
+import pickle
+import signal
+import struct
+import traceback
+import logging
+import zlib
+import re
+from logging.handlers import QueueHandler
+from collections import OrderedDict, deque
+from email.utils import parsedate_to_datetime
 from _thread import *
 
+#optional dependency (pip install brotli), without it the proxy only
+#builds gzip variants of the responses, nothing else needs it
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+#proxy events, and one line per served request on the access log
+log = logging.getLogger("proxy")
+access_log = logging.getLogger("proxy.access")
+
+#headers that only concern one connection, never forwarded as they are
+HOP_BY_HOP_HEADERS = {"connection", "proxy-connection", "keep-alive"}
+
+#headers of a request/response, still a list of [name, value] lists but with case-insensitive lookups
+class HttpHeaders(list):
+    """
+    A list of [name, value] lists (in the order they were received,
+    a name may repeat) with case-insensitive helpers on top.
+    """
+
+    __slots__ = ()
+
+    def get(self, name, default=None):
+        name = name.lower()
+        for header in self:
+            if header[0].lower() == name:
+                return header[1]
+        return default
+
+    def get_all(self, name):
+        name = name.lower()
+        return [header[1] for header in self if header[0].lower() == name]
+
+    def contains(self, name):
+        return self.get(name) is not None
+
+    def remove_all(self, name):
+        name = name.lower()
+        self[:] = [header for header in self if header[0].lower() != name]
+
+    def set(self, name, value):
+        """
+        Replaces every header called name by a single one.
+        """
+        lowered = name.lower()
+        for (i, header) in enumerate(self):
+            if header[0].lower() == lowered:
+                header[1] = value
+                self[i + 1:] = [h for h in self[i + 1:] if h[0].lower() != lowered]
+                return
+        self.append([name, value])
+
 #done
 class HttpRequestInfo(object):
     """
@@ -32,10 +106,14 @@ class HttpRequestInfo(object):
     NOTE: you need to implement to_http_string() for this class.
     """
 
+    __slots__ = ("method", "client_address_info", "requested_host",
+                 "requested_port", "requested_path", "headers", "http_version")
+
     def __init__(self, client_info, method: str, requested_host: str,
                  requested_port: int,
                  requested_path: str,
-                 headers: list):
+                 headers: list,
+                 http_version: str = "HTTP/1.0"):
         self.method = method
         self.client_address_info = client_info
         self.requested_host = requested_host
@@ -47,9 +125,11 @@ class HttpRequestInfo(object):
         # "Host: www.google.com:80"
         # convert it to ["Host", "www.google.com"] note that the
         # port is removed (because it goes into the request_port variable)
-        self.headers = headers
+        self.headers = headers if isinstance(headers, HttpHeaders) else HttpHeaders(headers)
+        # version the client spoke, decides if its connection is kept alive
+        self.http_version = http_version
 
-    def to_http_string(self):
+    def to_http_string(self, http_version="HTTP/1.0"):
         """
         Convert the HTTP request/response
         to a valid HTTP string.
@@ -68,12 +148,59 @@ class HttpRequestInfo(object):
         debugging and testing.
         """
 
-        http_string = self.method + " " + self.requested_path + " HTTP/1.0\r\n"
-        for i in range(len(self.headers)):
-            http_string += self.headers[i][0] +": " + self.headers[i][1] +"\r\n"
-        http_string += "\r\n"
+        return "".join(self._http_string_parts(http_version, False))
 
-        return http_string
+    def to_keep_alive_http_string(self):
+        """
+        Same as to_http_string but as an HTTP/1.1 request for a
+        persistent upstream connection: the client's hop-by-hop
+        headers are replaced by "Connection: keep-alive" and a Host
+        header is added if the request has none.
+        """
+        return "".join(self._http_string_parts("HTTP/1.1", True))
+
+    def to_bytes(self, http_version="HTTP/1.0"):
+        """
+        to_http_string and to_byte_array in one step: the
+        parts are joined and encoded once, no intermediate strings.
+        """
+        return "".join(self._http_string_parts(http_version, False)).encode("iso-8859-1")
+
+    def to_keep_alive_bytes(self):
+        """
+        to_keep_alive_http_string as bytes, see to_bytes.
+        """
+        return "".join(self._http_string_parts("HTTP/1.1", True)).encode("iso-8859-1")
+
+    def _http_string_parts(self, http_version, keep_alive):
+        parts = [self.method, " ", self.requested_path, " ", http_version, "\r\n"]
+        has_host = False
+        for (name, value) in self.headers:
+            if keep_alive:
+                lowered = name.lower()
+                if lowered in HOP_BY_HOP_HEADERS:
+                    continue
+                if lowered == "host":
+                    has_host = True
+            parts += (name, ": ", value, "\r\n")
+        if keep_alive:
+            if not has_host:
+                parts += ("Host: ", self.host_header_value(), "\r\n")
+            parts.append("Connection: keep-alive\r\n")
+        parts.append("\r\n")
+        return parts
+
+    def host_header_value(self):
+        """
+        The value of the Host header of this request: the host,
+        with the port only if it isn't the default one.
+        """
+        host = self.requested_host
+        if ":" in host:
+            host = "[" + host + "]"
+        if int(self.requested_port) != 80:
+            host += ":" + str(self.requested_port)
+        return host
 
     def to_byte_array(self, http_string):
         """
@@ -113,6 +240,23 @@ class HttpErrorResponse(object):
     def display(self):
         print(self.to_http_string())
 
+#a client or an origin took too long, answered with an HttpErrorResponse of code (408 or 504)
+class ProxyTimeout(OSError):
+    """
+    phase: what timed out ("client header", "upstream connect",
+    "upstream first byte", "upstream chunk" or "request deadline").
+    """
+
+    MESSAGES = {408: "Request Timeout", 504: "Gateway Timeout"}
+
+    def __init__(self, phase, code):
+        super().__init__(f"{phase} timed out")
+        self.phase = phase
+        self.code = code
+
+    def to_error_response(self):
+        return HttpErrorResponse(self.code, self.MESSAGES[self.code])
+
 #done
 class HttpRequestState(enum.Enum):
     """
@@ -126,287 +270,4268 @@ class HttpRequestState(enum.Enum):
     GOOD = 2
     PLACEHOLDER = -1
 
-#done
-def entry_point(proxy_port_number):
+#incremental version of parse_request_head, fed with the bytes read from the client
+class HttpRequestParser(object):
     """
-    Entry point, start your code here.
+    feed() the bytes read from a client connection as they come,
+    it returns True once the empty line ending a request head
+    arrived. Then state holds its HttpRequestState and request
+    its HttpRequestInfo (see parse_request_head); a head over
+    max_head_bytes is INVALID_INPUT.
 
-    Please don't delete this function,
-    but feel free to modify the code
-    inside it.
+    Bytes following the head (the next pipelined request) stay
+    in the parser, reset() starts parsing them.
     """
-    setup_sockets(proxy_port_number)
 
-    pass
+    def __init__(self, source_addr, max_head_bytes=65536):
+        self.source_addr = source_addr
+        self.max_head_bytes = max_head_bytes
+        self.buffer = bytearray()
+        self.search_from = 0
+        self.state = HttpRequestState.PLACEHOLDER
+        self.request = None
+        self.done = False
+        self.parse_seconds = 0.0
 
-#done
-def setup_server_socket(http_request_obj : HttpRequestInfo, client_socket : socket = None):
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    required_host = http_request_obj.requested_host
-    required_port = http_request_obj.requested_port
-    http_string = http_request_obj.to_http_string()
-    request_byte_arr = http_request_obj.to_byte_array(http_string)
-    response = do_server_socket_logic(server_socket,required_host,required_port,request_byte_arr,client_socket)
-    
-    return response
+    def feed(self, data):
+        self.buffer += data
+        if self.done:
+            return True
+        head_end = self.buffer.find(b"\r\n\r\n", self.search_from)
+        if head_end == -1:
+            if len(self.buffer) > self.max_head_bytes:
+                self.state = HttpRequestState.INVALID_INPUT
+                self.done = True
+            else:
+                self.search_from = max(0, len(self.buffer) - 3)
+            return self.done
+        with memoryview(self.buffer) as view:
+            head = bytes(view[:head_end])
+        del self.buffer[:head_end + 4]
+        started = time.perf_counter()
+        self.state, self.request = parse_request_head(self.source_addr, head)
+        self.parse_seconds = time.perf_counter() - started
+        self.done = True
+        return True
 
-#done
-def do_server_socket_logic(server_socket : socket, required_host: str ,required_port : int, request_byte_arr, client_socket : socket):
-    print(f"required_host: {required_host}")
-    print(f"required_port: {required_port}")
-    server_socket.connect((required_host,int(required_port)))
-    server_socket.send(request_byte_arr)
-    response = bytearray()
-    while True:
-        http_response = server_socket.recv(4096)
-        response += http_response
-        if(len(http_response) == 0):
-            break
-    
-    server_socket.close()
+    def reset(self):
+        self.state = HttpRequestState.PLACEHOLDER
+        self.request = None
+        self.done = False
+        self.search_from = 0
+        return self.feed(b"")
 
-    return response
+#Tunables of the proxy, every field can be overridden from the environment by load_proxy_config
+class ProxyConfig(object):
+    """
+    Holds the configurable settings of the proxy.
 
-#done
-def setup_sockets(proxy_port_number):
+    engine: "threaded" (a pool of client_threads threads, each
+    serving one client at a time, the default) or "asyncio" (one
+    event loop serving every client).
+
+    backlog: size of the listen() queue of the proxy socket.
+
+    max_concurrency: maximum number of clients the asyncio
+    engine serves at the same time, extra clients wait
+    for a free slot.
+
+    workers: number of worker processes. Above 1 a supervisor
+    forks the workers, each runs the engine on its own
+    SO_REUSEPORT socket bound to the proxy port and the
+    kernel spreads the connections between them.
     """
-    Socket logic MUST NOT be written in the any
-    class. Classes know nothing about the sockets.
 
-    But feel free to add your own classes/functions.
+    def __init__(self, engine="threaded", bind_host="127.0.0.1",
+                 backlog=10, max_concurrency=10000,
+                 cache_max_bytes=64 * 1024 * 1024, cache_max_entries=10000,
+                 cache_default_ttl=300.0, cache_stale_retention=3600.0,
+                 stream_responses=True,
+                 stream_cache_max_bytes=8 * 1024 * 1024, chunk_size=65536,
+                 upstream_keep_alive=True, pool_max_idle=100,
+                 pool_max_per_host=8, pool_idle_timeout=30.0,
+                 client_idle_timeout=15.0, client_max_requests=100,
+                 max_request_head_bytes=65536, log_level="INFO",
+                 log_file="", access_log=True, access_log_file="",
+                 metrics_port=0, workers=1, worker_restart_delay=1.0,
+                 shared_cache_file="", shared_cache_slab_size=4096,
+                 disk_cache_dir="", disk_cache_max_bytes=1024 * 1024 * 1024,
+                 dns_cache_ttl=60.0, dns_negative_ttl=5.0, dns_cache_max_entries=4096,
+                 client_threads=256, accept_queue_depth=512, shed_policy="reject",
+                 client_header_timeout=10.0, upstream_connect_timeout=5.0,
+                 upstream_first_byte_timeout=30.0, upstream_chunk_timeout=30.0,
+                 request_deadline=300.0, compression=True, compression_level=6,
+                 compression_min_bytes=1024, compression_threads=1,
+                 connect_ports="443", tunnel_idle_timeout=300.0, tunnel_buffer_size=65536,
+                 cache_key_sort_query=True, cache_key_ignored_params="", range_cache_fill=False,
+                 cache_admission=True):
+        self.engine = engine
+        self.bind_host = bind_host
+        self.backlog = backlog
+        self.max_concurrency = max_concurrency
+        # Response cache limits, cache_default_ttl (seconds) is used
+        # when the origin gives no Cache-Control/Expires information
+        self.cache_max_bytes = cache_max_bytes
+        self.cache_max_entries = cache_max_entries
+        self.cache_default_ttl = cache_default_ttl
+        # Stale responses with an ETag/Last-Modified stay cached this many
+        # seconds more, to be revalidated with a conditional request
+        self.cache_stale_retention = cache_stale_retention
+        # Streaming forwards upstream chunks to the client as they arrive,
+        # the response is only kept for the cache while it stays under
+        # stream_cache_max_bytes
+        self.stream_responses = stream_responses
+        self.stream_cache_max_bytes = stream_cache_max_bytes
+        self.chunk_size = chunk_size
+        # Persistent HTTP/1.1 connections to the origins, at most
+        # pool_max_per_host idle ones per (host, port) and pool_max_idle
+        # in total, each closed after pool_idle_timeout seconds unused
+        self.upstream_keep_alive = upstream_keep_alive
+        self.pool_max_idle = pool_max_idle
+        self.pool_max_per_host = pool_max_per_host
+        self.pool_idle_timeout = pool_idle_timeout
+        # Persistent client connections are closed after client_idle_timeout
+        # seconds without a request or after client_max_requests requests
+        self.client_idle_timeout = client_idle_timeout
+        self.client_max_requests = client_max_requests
+        # Seconds (0 for no limit) a client has to send the rest of a
+        # request head once it started it, else it gets a 408
+        self.client_header_timeout = client_header_timeout
+        self.max_request_head_bytes = max_request_head_bytes
+        # Logging, an empty file name means stdout
+        self.log_level = log_level
+        self.log_file = log_file
+        self.access_log = access_log
+        self.access_log_file = access_log_file
+        # Port of the /metrics endpoint (Prometheus text format), 0 disables it
+        self.metrics_port = metrics_port
+        # Worker processes, a worker that dies is forked again, after
+        # worker_restart_delay seconds if it died shortly after starting
+        self.workers = workers
+        self.worker_restart_delay = worker_restart_delay
+        # With a file name the response cache is a SharedResponseCache in that
+        # file (cache_max_bytes of data), shared by every worker of the host
+        self.shared_cache_file = shared_cache_file
+        self.shared_cache_slab_size = shared_cache_slab_size
+        # With a directory, responses are also kept in a DiskCache there (at
+        # most disk_cache_max_bytes) and served from it after a restart,
+        # every worker uses its own worker-<n> subdirectory
+        self.disk_cache_dir = disk_cache_dir
+        self.disk_cache_max_bytes = disk_cache_max_bytes
+        # Resolved origin addresses are cached dns_cache_ttl seconds,
+        # failed lookups dns_negative_ttl seconds
+        self.dns_cache_ttl = dns_cache_ttl
+        self.dns_negative_ttl = dns_negative_ttl
+        self.dns_cache_max_entries = dns_cache_max_entries
+        # The threaded engine serves the clients with client_threads threads,
+        # at most accept_queue_depth accepted clients wait for one, then
+        # shed_policy ("reject" or "drop-oldest") picks the client that gets
+        # an immediate 503
+        self.client_threads = client_threads
+        self.accept_queue_depth = accept_queue_depth
+        self.shed_policy = shed_policy
+        # Seconds (0 for no limit) to connect to an origin, to get the first
+        # byte of its response and each following chunk, and for the whole
+        # exchange with it, a request whose response hasn't started when one
+        # runs out gets a 504
+        self.upstream_connect_timeout = upstream_connect_timeout
+        self.upstream_first_byte_timeout = upstream_first_byte_timeout
+        self.upstream_chunk_timeout = upstream_chunk_timeout
+        self.request_deadline = request_deadline
+        # Cached responses of a compressible type are compressed (gzip, or br
+        # with the optional brotli package installed) for the clients accepting it, on
+        # compression_threads background threads, and the compressed variant
+        # is cached next to the identity one
+        self.compression = compression
+        self.compression_level = compression_level
+        self.compression_min_bytes = compression_min_bytes
+        self.compression_threads = compression_threads
+        # CONNECT tunnels may only reach the comma-separated connect_ports
+        # ("*" for any), they are closed after tunnel_idle_timeout seconds
+        # without a byte in either direction
+        self.connect_ports = connect_ports
+        self.tunnel_idle_timeout = tunnel_idle_timeout
+        self.tunnel_buffer_size = tunnel_buffer_size
+        # Cache keys ignore the order of the query parameters if
+        # cache_key_sort_query, and the comma-separated
+        # cache_key_ignored_params ("utm_*" matches a prefix) entirely
+        self.cache_key_sort_query = cache_key_sort_query
+        self.cache_key_ignored_params = cache_key_ignored_params
+        # A Range request missing the cache fetches the whole object if
+        # range_cache_fill (the client gets its slice once the origin sent
+        # it, the next ranges hit), else the range is asked to the origin
+        # and its 206 isn't cached
+        self.range_cache_fill = range_cache_fill
+        # A full cache only lets a new response push entries out if its
+        # URL was asked for more often than theirs lately (TinyLFU)
+        self.cache_admission = cache_admission
 
-    Feel free to delete this function.
+    def display(self):
+        for (k, v) in vars(self).items():
+            print(f"{k}:", v)
+
+#approximate recent request counts of the cache keys, the admission filter of the caches (TinyLFU)
+class FrequencySketch(object):
     """
-    print("Starting HTTP proxy on port:", proxy_port_number)
-    
-    proxy_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    do_socket_logic(proxy_socket,proxy_port_number)
-   
-    pass
+    A count-min sketch: DEPTH rows of width one-byte counters, a key
+    has a counter in each row and its estimate is the smallest of
+    them. Counters saturate at MAX_COUNT, and every sample_size
+    increments all of them are halved so old popularity fades.
 
-#do socket logic of Proxy, client TCP Connection, basically get the HTTP request and call Http_request_pipeline here and stay on the loop
-def do_socket_logic(proxy_socket: socket,proxy_port_number):
+    Not thread-safe, the caches use it under their own lock.
     """
-    Example function for some helper logic, in case you
-    want to be tidy and avoid stuffing the main function.
 
-    Feel free to delete this function.
+    DEPTH = 4
+    MAX_COUNT = 15
+    HALVE = bytes(count >> 1 for count in range(256))
+
+    def __init__(self, width, sample_size=None):
+        self.width = 1 << max(4, (max(1, width) - 1).bit_length())
+        self.mask = self.width - 1
+        self.table = bytearray(self.width * self.DEPTH)
+        self.sample_size = 10 * self.width if sample_size is None else sample_size
+        self.additions = 0
+        self.resets = 0
+
+    def increment(self, key):
+        table = self.table
+        slots = self._slots(key)
+        smallest = min(table[slot] for slot in slots)
+        if smallest < self.MAX_COUNT:
+            # conservative update, only the counters holding the estimate grow
+            for slot in slots:
+                if table[slot] == smallest:
+                    table[slot] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self.table = table.translate(self.HALVE)
+            self.additions //= 2
+            self.resets += 1
+
+    def estimate(self, key):
+        table = self.table
+        return min(table[slot] for slot in self._slots(key))
+
+    def _slots(self, key):
+        key_hash = hash(key) & 0xFFFFFFFFFFFFFFFF
+        low = key_hash & 0xFFFFFFFF
+        high = (key_hash >> 32) | 1
+        return [row * self.width + ((low + row * high) & self.mask) for row in range(self.DEPTH)]
+
+#one stored response of the ResponseCache
+class CacheEntry(object):
     """
+    response: the full response bytes as received from the origin.
 
-    proxy_socket.bind(("127.0.0.1",int(proxy_port_number)))
-    proxy_socket.listen(10)
-    cache = {}
-    while True:
-        client_socket, address =  proxy_socket.accept()
-        print(f"Started conn with {address}")
-        start_new_thread(handle_client,(client_socket,cache, address))
-    proxy_socket.close()
+    expires_at: time.monotonic() value after which the entry is stale.
 
-    pass
+    stale_until: time.monotonic() value after which the stale entry is
+    dropped instead of kept for revalidation.
+    """
 
-# add your logic here, this is called during threading
-def handle_client(client_socket,cache, address):
-    #get source_addr, http raw data from telnet's input
-    telnet_input = bytearray()
-    while True:
-        data = client_socket.recv(4096)
-        if(data.decode("utf-8") == '\r\n'):
-            break
-        telnet_input += data
-    print(telnet_input)
-    #do the request pipeine then check for error 
-    http = http_request_pipeline(address, telnet_input.decode('utf-8'))
-    check = isinstance(http,HttpErrorResponse)
-    if check :
-        error_string = http.to_http_string()
-        client_socket.send(http.to_byte_array(error_string))
-        client_socket.close()
-        pass
-    #remove next line when you implement your part and uncomment the previous lines
-    # http = HttpRequestInfo(("127.0.0.1", 18888), "GET", "www.apache.org", 80, "/", [["Host", "www.google.com"], ["Accept", "application/json"]])
-    response = cache[http.requested_host+":"+str(http.requested_port)+http.requested_path] if http.requested_host+":"+str(http.requested_port)+http.requested_path in cache else setup_server_socket(http,client_socket)
-    cache[http.requested_host+":"+str(http.requested_port)+http.requested_path] = response
-    client_socket.send(response)
-    client_socket.close()
-    print(f"Finished!")
-    pass
-#Http's Highlevel method, everything concerning Validation, parsing, sanitizing is put here, returns HTTPRequestInfo in the end to be used to send TCP to needed website
-#Returns HTTPErrorResponse object if not valid using validity local variable
-def http_request_pipeline(source_addr, http_raw_data):
+    def __init__(self, response, expires_at, stale_until=None):
+        self.response = response
+        self.expires_at = expires_at
+        self.stale_until = expires_at if stale_until is None else stale_until
+        self.size = len(response)
+
+#bounded LRU cache of upstream responses, safe to share between the client threads
+class ResponseCache(object):
     """
-#Returns HTTPErrorResponse object if not valid using validity local variable
+    Stores full upstream responses keyed by the cache key of the request.
 
-    - Validates the given HTTP request and returns
-      an error if an invalid request was given.
-    - Parses it
-    - Returns a sanitized HttpRequestInfo
+    Entries are evicted least-recently-used first whenever the total
+    size of the stored responses exceeds max_bytes or the number of
+    entries exceeds max_entries. Each entry has its own expiry time,
+    an expired entry counts as a miss. It is dropped unless it was
+    stored with a retain time, then get_stale() still returns it
+    (to be revalidated) until that time is over too.
 
-    returns:
-     HttpRequestInfo if the request was parsed correctly.
-     HttpErrorResponse if the request was invalid.
+    With an admission FrequencySketch every lookup is counted in it,
+    and a new entry is only stored if it is asked for more often
+    than each of the entries it would evict (see admits_over), so
+    a burst of one-time requests can't flush the popular entries.
 
-    Please don't remove this function, but feel
-    free to change its content
+    hits, misses, evictions and rejections (entries not admitted)
+    count what happened since creation.
     """
-    # Parse HTTP request
-    print(f"Http raw data: {http_raw_data}")
-    print(f"source address(tuble): {source_addr}")
-    validity = check_http_request_validity(http_raw_data)
-    if(validity == HttpRequestState.NOT_SUPPORTED):
-        code = 500
-        message = "Not supported"
-        return HttpErrorResponse(code,message)
-    elif(validity == HttpRequestState.INVALID_INPUT):
-        code = 400
-        message = "Bad Request"
-        return HttpErrorResponse(code, message)
-    # Return error if needed, then:
-    httprequest =  parse_http_request(source_addr, http_raw_data)
-    # sanitize_http_request()
-    # Validate, sanitize, return Http object.
-   
-    return httprequest
 
-#parses the contents of an http request, and returns an HTTP Request Object
-def parse_http_request(source_addr, http_raw_data):
+    def __init__(self, max_bytes, max_entries, default_ttl, stale_retention=0.0, admission : FrequencySketch = None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.stale_retention = stale_retention
+        self.admission = admission
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejections = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, count_miss=True):
+        """
+        Returns the cached response of key, or None on a miss.
+        count_miss is False for lookups followed by another one
+        (of the identity response after its compressed variants).
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            now = time.monotonic()
+            if entry is not None and entry.expires_at <= now:
+                if entry.stale_until <= now:
+                    self._remove(key)
+                entry = None
+            if entry is None:
+                if count_miss:
+                    self.misses += 1
+                    self._record_access(key)
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            self._record_access(key)
+            return entry.response
+
+    def get_stale(self, key):
+        """
+        Returns (response, seconds since it went stale) of an entry
+        kept for revalidation, or None.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            now = time.monotonic()
+            if entry is None or entry.stale_until <= now:
+                return None
+            self.entries.move_to_end(key)
+            return (entry.response, now - entry.expires_at)
+
+    def put(self, key, response, ttl, retain=0.0):
+        """
+        Stores response for ttl seconds (then keeps it retain more
+        seconds for revalidation), evicting the least recently used
+        entries until the limits hold again. Responses bigger than
+        the whole cache are not stored.
+        """
+        if (ttl <= 0 and retain <= 0) or len(response) > self.max_bytes:
+            return False
+        expires_at = time.monotonic() + max(0, ttl)
+        entry = CacheEntry(bytes(response), expires_at, expires_at + retain)
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            elif not self._admit(key, entry.size):
+                self.rejections += 1
+                return False
+            self.entries[key] = entry
+            self.current_bytes += entry.size
+            while (self.current_bytes > self.max_bytes
+                   or len(self.entries) > self.max_entries):
+                oldest_key = next(iter(self.entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+        return True
+
+    def refresh(self, key, ttl, retain=0.0):
+        """
+        Makes an entry fresh for ttl more seconds (a 304 revalidated it).
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry.expires_at = time.monotonic() + max(0, ttl)
+                entry.stale_until = entry.expires_at + retain
+
+    def release(self, response):
+        """
+        Nothing to do, the cached responses are immutable bytes.
+        """
+        pass
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.current_bytes -= entry.size
+
+    def _record_access(self, key):
+        if self.admission is not None:
+            self.admission.increment(variant_base_key(key))
+
+    def _admit(self, key, size):
+        """
+        Whether a new entry of size bytes may evict the least
+        recently used entries it needs the room of.
+        """
+        if self.admission is None:
+            return True
+        needed_bytes = self.current_bytes + size - self.max_bytes
+        needed_entries = len(self.entries) + 1 - self.max_entries
+        if needed_bytes <= 0 and needed_entries <= 0:
+            return True
+        frequency = self.admission.estimate(variant_base_key(key))
+        now = time.monotonic()
+        for (victim_key, victim) in self.entries.items():
+            if needed_bytes <= 0 and needed_entries <= 0:
+                break
+            # an entry past its retain time goes anyway
+            if victim.stale_until > now and not admits_over(frequency, self.admission.estimate(variant_base_key(victim_key))):
+                return False
+            needed_bytes -= victim.size
+            needed_entries -= 1
+        return True
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.current_bytes,
+                    "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "rejections": self.rejections}
+
+    def display(self):
+        print("Cache:", self.stats())
+
+#response cache in a memory-mapped file, shared by every process that opens the same file
+class SharedResponseCache(object):
     """
-    This function parses a "valid" HTTP request into an HttpRequestInfo
-    object.
+    Same interface as ResponseCache, but the entries live in a file
+    mapped with mmap, so every worker of a host uses one cache.
+
+    The file holds a header, an allocation map (a byte per slab),
+    an open-addressing hash index and the data area cut into
+    slab_size slabs. An entry (its key, then the response) takes
+    a run of contiguous slabs. Updates hold a thread lock and an
+    flock() of the file.
+
+    get() returns a memoryview of the mapped response, nothing is
+    copied, and pins the entry: its slabs are not reused until
+    release(). A pin older than PIN_LEASE seconds is ignored, it
+    was left by a process that died while sending.
+
+    Eviction frees the least recently used of EVICTION_SAMPLES
+    sampled entries, expired ones first. Times are time.time()
+    values, they mean the same in every process. Expired entries
+    are kept for revalidation like in ResponseCache.
+
+    The admission FrequencySketch works like in ResponseCache, each
+    process counts the lookups it makes in its own one.
     """
-    
-    # Replace this line with the correct values.
-    listoflists = tokenization(http_raw_data)
-    method = listoflists[0]
-    method = method.upper()
-    url = listoflists[1]
-    url = url.lower()
-    httpversion = listoflists[2]
-    host = ""
-    path = ""
-    if(url.startswith('/')):
-        path = url
-        hostarray = listoflists[3]
-        host_and_port = hostarray[0][1]
-        host_and_port_array = host_and_port.split(':')
-        if(len(host_and_port_array) < 2):
-            host = host_and_port_array[0]
-            port = 80
-        else:
-            host = host_and_port_array[0]
-            port = host_and_port_array[1]
-    else:
-        hostarray =  url.split('://')
-        host_and_port = hostarray[1]
-        host_and_port_array = host_and_port.split(':')
-        if(len(host_and_port_array) < 2):
-            port = 80
-            host_and_path = host_and_port_array[0]
-        else:
-            port_path = host_and_port_array[1]
-            if(port_path.endswith('/')):
-                port = port_path.split('/')[0]
-                path = '/' + port_path.split('/')[1]
-            host_and_path = host_and_port_array[0]
-        host_and_path_array = host_and_path.split('/', 1)
-        host = host_and_path_array[0]
-        #port = '/' + host_and_path_array[1]
-        if(path != ""):
-            if(len(host_and_path_array) == 2):
-                path = "/" + host_and_path_array[1]
+
+    MAGIC = b"PXYSHC02"
+    # magic, index slots, slab size, slab count, entries, response bytes
+    HEADER = struct.Struct("<8sIIQQQ")
+    # key hash, state, first slab, slab count, key length, response length,
+    # expires at, last used, pinned at, pins, stale until
+    ENTRY = struct.Struct("<QIIIIQdddId4x")
+    FREE = 0
+    USED = 1
+    PAGE = 4096
+    PIN_LEASE = 300.0
+    EVICTION_SAMPLES = 8
+    MAX_EVICTIONS_PER_PUT = 256
+
+    def __init__(self, file_name, max_bytes, max_entries, default_ttl, slab_size=4096, stale_retention=0.0, admission : FrequencySketch = None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.stale_retention = stale_retention
+        self.admission = admission
+        self.slab_size = slab_size
+        self.slab_count = max(1, max_bytes // slab_size)
+        self.index_slots = max(16, 2 * max_entries)
+        self.bitmap_start = self.PAGE
+        self.index_start = self._page_align(self.bitmap_start + self.slab_count)
+        self.data_start = self._page_align(self.index_start + self.index_slots * self.ENTRY.size)
+        size = self.data_start + self.slab_count * slab_size
+        self.lock = threading.Lock()
+        # id() of the memoryviews handed out -> (key, hash, first slab) of the pinned entry
+        self.pinned = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejections = 0
+        self.fd = os.open(file_name, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self.fd).st_size != size:
+                os.ftruncate(self.fd, 0)
+                os.ftruncate(self.fd, size)
+            self.map = mmap.mmap(self.fd, size)
+            layout = (self.MAGIC, self.index_slots, self.slab_size, self.slab_count)
+            if self.HEADER.unpack_from(self.map, 0)[:4] != layout:
+                # another layout (or a new file), start empty
+                self.map[:self.data_start] = bytes(self.data_start)
+                self.HEADER.pack_into(self.map, 0, *layout, 0, 0)
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def get(self, key, count_miss=True):
+        """
+        Returns a memoryview of the cached response of key, or None on
+        a miss. The caller gives it back with release() once sent.
+        """
+        found = self._get(key, False, count_miss)
+        return None if found is None else found[0]
+
+    def get_stale(self, key):
+        """
+        Returns (memoryview of the response, seconds since it went
+        stale) of an entry kept for revalidation, or None. The caller
+        gives the response back with release().
+        """
+        return self._get(key, True)
+
+    def refresh(self, key, ttl, retain=0.0):
+        key_bytes = key.encode("utf-8")
+        now = time.time()
+        self._lock_file()
+        try:
+            slot, entry = self._find(key_bytes, self._hash(key_bytes))
+            if entry is not None:
+                entry[6] = now + max(0, ttl)
+                entry[10] = entry[6] + retain
+                self._write_entry(slot, entry)
+        finally:
+            self._unlock_file()
+
+    def _get(self, key, stale, count_miss=True):
+        key_bytes = key.encode("utf-8")
+        key_hash = self._hash(key_bytes)
+        now = time.time()
+        self._lock_file()
+        try:
+            slot, entry = self._find(key_bytes, key_hash)
+            if entry is not None and entry[10] <= now:
+                if not self._is_pinned(entry, now):
+                    self._remove(slot, entry)
+                entry = None
+            if not stale and entry is not None and entry[6] <= now:
+                entry = None
+            if entry is None:
+                if not stale and count_miss:
+                    self.misses += 1
+                    self._record_access(key)
+                return None
+            entry[9] = (entry[9] if self._is_pinned(entry, now) else 0) + 1
+            entry[7] = now
+            entry[8] = now
+            self._write_entry(slot, entry)
+            if not stale:
+                self.hits += 1
+                self._record_access(key)
+            start = self.data_start + entry[2] * self.slab_size + entry[4]
+            response = memoryview(self.map)[start:start + entry[5]]
+            self.pinned[id(response)] = (key_bytes, key_hash, entry[2])
+            return (response, now - entry[6])
+        finally:
+            self._unlock_file()
+
+    def release(self, response):
+        """
+        Unpins the entry a response returned by get() belongs to.
+        """
+        self._lock_file()
+        try:
+            pin = self.pinned.pop(id(response), None)
+            if pin is None:
+                return
+            key_bytes, key_hash, first_slab = pin
+            slot, entry = self._find(key_bytes, key_hash)
+            if entry is not None and entry[2] == first_slab and entry[9] > 0:
+                entry[9] -= 1
+                self._write_entry(slot, entry)
+        finally:
+            self._unlock_file()
+
+    def put(self, key, response, ttl, retain=0.0):
+        """
+        Stores response for ttl seconds (then keeps it retain more
+        seconds for revalidation), evicting entries until it fits.
+        Responses bigger than the whole cache, or replacing an entry
+        that is being sent, are not stored.
+        """
+        key_bytes = key.encode("utf-8")
+        size = len(key_bytes) + len(response)
+        slabs = -(-size // self.slab_size)
+        if (ttl <= 0 and retain <= 0) or slabs > self.slab_count:
+            return False
+        key_hash = self._hash(key_bytes)
+        now = time.time()
+        self._lock_file()
+        try:
+            slot, entry = self._find(key_bytes, key_hash)
+            if entry is not None:
+                if self._is_pinned(entry, now):
+                    return False
+                self._remove(slot, entry)
+                frequency = None
             else:
-                path = "/"
-    header = listoflists[3]            
-    ret = HttpRequestInfo(source_addr, method, host, port, path, header)
-    return ret
+                frequency = None if self.admission is None else self.admission.estimate(variant_base_key(key))
+            first_slab = self._allocate(slabs, now, frequency)
+            if first_slab is None:
+                return False
+            start = self.data_start + first_slab * self.slab_size
+            self.map[start:start + len(key_bytes)] = key_bytes
+            self.map[start + len(key_bytes):start + size] = response
+            # removals shift entries, look the free slot up again
+            slot, entry = self._find(key_bytes, key_hash)
+            expires_at = now + max(0, ttl)
+            self._write_entry(slot, [key_hash, self.USED, first_slab, slabs, len(key_bytes),
+                                     len(response), expires_at, now, 0.0, 0, expires_at + retain])
+            self._count(1, len(response))
+            return True
+        finally:
+            self._unlock_file()
 
-#Checks the http request if it is a valid request
-def check_http_request_validity(http_raw_data) -> HttpRequestState:
+    def stats(self):
+        with self.lock:
+            header = self.HEADER.unpack_from(self.map, 0)
+            return {"entries": header[4], "bytes": header[5],
+                    "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "rejections": self.rejections}
+
+    def display(self):
+        print("Shared cache:", self.stats())
+
+    def _page_align(self, offset):
+        return -(-offset // self.PAGE) * self.PAGE
+
+    def _hash(self, key_bytes):
+        return int.from_bytes(hashlib.blake2b(key_bytes, digest_size=8).digest(), "little")
+
+    def _lock_file(self):
+        self.lock.acquire()
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+
+    def _unlock_file(self):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.lock.release()
+
+    def _entry(self, slot):
+        return list(self.ENTRY.unpack_from(self.map, self.index_start + slot * self.ENTRY.size))
+
+    def _write_entry(self, slot, entry):
+        self.ENTRY.pack_into(self.map, self.index_start + slot * self.ENTRY.size, *entry)
+
+    def _count(self, entries, response_bytes):
+        header = self.HEADER.unpack_from(self.map, 0)
+        self.HEADER.pack_into(self.map, 0, *header[:4], header[4] + entries, header[5] + response_bytes)
+
+    def _is_pinned(self, entry, now):
+        return entry[9] > 0 and now - entry[8] < self.PIN_LEASE
+
+    def _find(self, key_bytes, key_hash):
+        """
+        Returns (slot, entry) of key, or (free slot, None) if missing.
+        """
+        slot = key_hash % self.index_slots
+        while True:
+            entry = self._entry(slot)
+            if entry[1] == self.FREE:
+                return (slot, None)
+            if entry[0] == key_hash:
+                start = self.data_start + entry[2] * self.slab_size
+                if self.map[start:start + entry[4]] == key_bytes:
+                    return (slot, entry)
+            slot = (slot + 1) % self.index_slots
+
+    def _record_access(self, key):
+        if self.admission is not None:
+            self.admission.increment(variant_base_key(key))
+
+    def _allocate(self, slabs, now, frequency=None):
+        """
+        frequency: the admission estimate of the new entry, None
+        if it may evict any entry.
+        """
+        for i in range(self.MAX_EVICTIONS_PER_PUT):
+            if self.HEADER.unpack_from(self.map, 0)[4] < self.max_entries:
+                found = self.map.find(bytes(slabs), self.bitmap_start, self.bitmap_start + self.slab_count)
+                if found != -1:
+                    self.map[found:found + slabs] = b"\x01" * slabs
+                    return found - self.bitmap_start
+            if not self._evict_one(now, frequency):
+                return None
+        return None
+
+    def _evict_one(self, now, frequency=None):
+        slot = random.randrange(self.index_slots)
+        victim = None
+        sampled = 0
+        for i in range(self.index_slots):
+            entry = self._entry(slot)
+            if entry[1] == self.USED and not self._is_pinned(entry, now):
+                # expired entries first, then the least recently used
+                rank = (entry[6] > now, entry[7])
+                if victim is None or rank < victim[0]:
+                    victim = (rank, slot, entry)
+                sampled += 1
+                if sampled == self.EVICTION_SAMPLES:
+                    break
+            slot = (slot + 1) % self.index_slots
+        if victim is None:
+            return False
+        entry = victim[2]
+        if frequency is not None and entry[10] > now:
+            start = self.data_start + entry[2] * self.slab_size
+            victim_key = bytes(self.map[start:start + entry[4]]).decode("utf-8")
+            if not admits_over(frequency, self.admission.estimate(variant_base_key(victim_key))):
+                self.rejections += 1
+                return False
+        self._remove(victim[1], entry)
+        self.evictions += 1
+        return True
+
+    def _remove(self, slot, entry):
+        start = self.bitmap_start + entry[2]
+        self.map[start:start + entry[3]] = bytes(entry[3])
+        self._count(-1, -entry[5])
+        # backward shift deletion: move later entries of the probe run into the hole
+        hole = slot
+        slot = (slot + 1) % self.index_slots
+        while True:
+            entry = self._entry(slot)
+            if entry[1] == self.FREE:
+                break
+            home = entry[0] % self.index_slots
+            if hole < slot:
+                stays = hole < home <= slot
+            else:
+                stays = home > hole or home <= slot
+            if not stays:
+                self._write_entry(hole, entry)
+                hole = slot
+            slot = (slot + 1) % self.index_slots
+        self._write_entry(hole, [0] * 11)
+
+#what the disk cache knows about one stored response
+class DiskCacheEntry(object):
     """
-    Checks if an HTTP request is valid
+    digest: sha256 (hex) of the response, names its file.
 
-    returns:
-    One of values in HttpRequestState
+    head_length: bytes of the response head, the body follows it.
+
+    expires_at: time.time() value after which the entry is stale.
     """
-    print("*" * 50)
-    print("[check_http_request_validity] Implement me!")
-    print("*" * 50)
-    listoflists = tokenization(http_raw_data)
-    if(isinstance(listoflists,HttpRequestState)):#to check if the first element is only = 3
-        print("NOT IMPLEMENTED")
-        return HttpRequestState.INVALID_INPUT
-    try:
-        method = listoflists[0]
-        method = method.upper()
-        url = listoflists[1]
-        httpversion = listoflists[2]
-        print(f"METHOD: {method}  URL: {url}  HTTPVERSION: {httpversion}")
-        if(len(method) == 0):
-            print("NOT IMPLEMENTED 1")
-            return HttpRequestState.INVALID_INPUT
-        list_methods = {"GET", "HEAD", "POST", "PUT"}
-        if(method not in list_methods):
-            print("NOT IMPLEMENTED 2")
-            return HttpRequestState.INVALID_INPUT
-        if(len(url) == 0):
-            print("NOT IMPLEMENTED 3")
-            return HttpRequestState.INVALID_INPUT
-        if(url == '/'):
-            hostlist = listoflists[3]
-            print(f"VALUEEEEEEEEE: {hostlist[0]}")
-            if(len(hostlist[0][1]) == 0):
-                print("NOT IMPLEMENTED RELATIVE PATH")
-                return HttpRequestState.INVALID_INPUT
-        if(len(httpversion) == 0):
-            print("NOT IMPLEMENTED 4")
-            return HttpRequestState.INVALID_INPUT
-        if( (httpversion.split("/")[1] != '1.1') and (httpversion.split("/")[1] != '1.0')):
-            print(F"HTTP VERSIONNNNNNNNNNNNNN: {httpversion}")
-            print(httpversion.split("/")[1])
-            print("NOT IMPLEMENTED Http version")
-            return HttpRequestState.INVALID_INPUT
-        if(not httpversion.startswith("HTTP/")):
-            print("NOT IMPLEMENTED 5")
-            return HttpRequestState.INVALID_INPUT
-        if(method != "GET"):
-            print("NOT SUPPORTED")
-            return HttpRequestState.NOT_SUPPORTED
-        return HttpRequestState.GOOD
-    except Exception as e: 
-        print(e)
-        print("Error in catch")
-        return HttpRequestState.INVALID_INPUT
-    # return HttpRequestState.GOOD (for example)
-    # return HttpRequestState.PLACEHOLDER
-
-def tokenization(http_raw_data):
-    print("http raw data {http_raw_data}")
-    listoflists = []
-    http_raw_data = http_raw_data.rstrip()
-    line_elements = http_raw_data.split("\r\n")
-    line_elements[0] = line_elements[0].rstrip()
-    print(f"Line_elements: {line_elements}")
-    first_line = line_elements[0].split(" ")
-    if(len(first_line) != 3):
-        print("NOT IMPLEMENTED")
-        return HttpRequestState.INVALID_INPUT
-    for elem in first_line:
-        listoflists.append(elem)
-    listofheaders = []
-    for i in range (1, len(line_elements) ):
-        line_elements[i] = line_elements[i].rstrip()
-        if(":" not in line_elements[i]):
-            print("NOT IMPLEMENTED")
-            return HttpRequestState.INVALID_INPUT
-        header_line = line_elements[i].split(":", 1)
-        print(f"HEADEER LINE AFTER SPLIT: {header_line}")
-        if(len(header_line) == 2):
-            listofheaders.append([header_line[0].strip(), header_line[1].strip()])
+
+    def __init__(self, digest, size, head_length, expires_at):
+        self.digest = digest
+        self.size = size
+        self.head_length = head_length
+        self.expires_at = expires_at
+
+#second cache tier, responses kept in files so they survive a restart
+class DiskCache(object):
+    """
+    Each response is written once to objects/<digest[:2]>/<digest>,
+    named by the sha256 of its bytes, so keys with the same response
+    share one file. The index (key -> DiskCacheEntry, least recently
+    used first) is kept in memory and appended to the "index" journal
+    file, which is loaded and compacted at startup: entries that
+    expired or lost their file are dropped, and so are files no entry
+    points to.
+
+    Entries are evicted least-recently-used first while the files
+    take more than max_bytes. put() only queues the response, the
+    hashing and writing happen on a writer thread, responses are
+    dropped (dropped_writes) when max_pending are already waiting.
+    get() opens the file, a file evicted while it is sent stays
+    readable until closed.
+    """
+
+    def __init__(self, directory, max_bytes, default_ttl, max_pending=256):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.entries = OrderedDict()
+        # digest -> number of entries using its file
+        self.references = {}
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.dropped_writes = 0
+        self.journal_records = 0
+        self.lock = threading.Lock()
+        self.pending = queue.Queue(max_pending)
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "tmp"), exist_ok=True)
+        self._load()
+        self.thread = threading.Thread(target=self._run, name="disk-cache-writer", daemon=True)
+        self.thread.start()
+
+    def get(self, key):
+        """
+        Returns (open file, DiskCacheEntry) of key, or None on a miss.
+        The caller closes the file.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.expires_at <= time.time():
+                self._remove(key)
+                self._journal(f"del\t{key}\n")
+                entry = None
+            stored = None
+            if entry is not None:
+                try:
+                    stored = (open(self._object_path(entry.digest), "rb"), entry)
+                except OSError:
+                    self._remove(key)
+                    self._journal(f"del\t{key}\n")
+            if stored is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return stored
+
+    def put(self, key, response, ttl):
+        if ttl <= 0 or len(response) > self.max_bytes:
+            return False
+        try:
+            self.pending.put_nowait((key, bytes(response), time.time() + ttl))
+        except queue.Full:
+            self.dropped_writes += 1
+            return False
+        return True
+
+    def stop(self):
+        self.pending.put(None)
+        self.thread.join()
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.current_bytes,
+                    "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions,
+                    "dropped_writes": self.dropped_writes}
+
+    def display(self):
+        print("Disk cache:", self.stats())
+
+    def _object_path(self, digest):
+        return os.path.join(self.directory, "objects", digest[:2], digest)
+
+    def _run(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            try:
+                self._store(*item)
+            except OSError as e:
+                log.warning("Disk cache write failed: %s", e)
+
+    def _store(self, key, response, expires_at):
+        digest = hashlib.sha256(response).hexdigest()
+        path = self._object_path(digest)
+        with self.lock:
+            exists = digest in self.references
+        if not exists:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temporary = os.path.join(self.directory, "tmp", f"{digest}.{threading.get_ident()}")
+            with open(temporary, "wb") as output:
+                output.write(response)
+            os.replace(temporary, path)
+        head_end = response.find(b"\r\n\r\n")
+        entry = DiskCacheEntry(digest, len(response), head_end + 4 if head_end != -1 else len(response), expires_at)
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self._add(key, entry)
+            self._journal(f"put\t{entry.expires_at}\t{entry.size}\t{entry.head_length}\t{digest}\t{key}\n")
+            while self.current_bytes > self.max_bytes:
+                oldest_key = next(iter(self.entries))
+                self._remove(oldest_key)
+                self._journal(f"del\t{oldest_key}\n")
+                self.evictions += 1
+            if self.journal_records > 2 * len(self.entries) + 1000:
+                self._compact()
+
+    def _add(self, key, entry):
+        self.entries[key] = entry
+        count = self.references.get(entry.digest, 0)
+        if count == 0:
+            self.current_bytes += entry.size
+        self.references[entry.digest] = count + 1
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        count = self.references[entry.digest] - 1
+        if count > 0:
+            self.references[entry.digest] = count
+            return
+        del self.references[entry.digest]
+        self.current_bytes -= entry.size
+        try:
+            os.unlink(self._object_path(entry.digest))
+        except OSError:
+            pass
+
+    def _journal(self, record):
+        self.journal.write(record)
+        self.journal.flush()
+        self.journal_records += 1
+
+    def _load(self):
+        """
+        Replays the journal, drops what expired or lost its file and
+        the files nothing points to, then writes the compacted index.
+        """
+        index_path = os.path.join(self.directory, "index")
+        loaded = OrderedDict()
+        try:
+            with open(index_path, "r", encoding="utf-8") as journal:
+                for line in journal:
+                    fields = line.rstrip("\n").split("\t")
+                    if fields[0] == "put" and len(fields) == 6:
+                        loaded.pop(fields[5], None)
+                        loaded[fields[5]] = DiskCacheEntry(fields[4], int(fields[2]), int(fields[3]), float(fields[1]))
+                    elif fields[0] == "del" and len(fields) == 2:
+                        loaded.pop(fields[1], None)
+        except (OSError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                log.warning("Disk cache index unreadable, starting empty: %s", e)
+        now = time.time()
+        for (key, entry) in loaded.items():
+            if entry.expires_at > now and os.path.exists(self._object_path(entry.digest)):
+                self._add(key, entry)
+        objects = os.path.join(self.directory, "objects")
+        for prefix in os.listdir(objects):
+            for name in os.listdir(os.path.join(objects, prefix)):
+                if name not in self.references:
+                    os.unlink(os.path.join(objects, prefix, name))
+        temporary = os.path.join(self.directory, "tmp")
+        for name in os.listdir(temporary):
+            os.unlink(os.path.join(temporary, name))
+        while self.current_bytes > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+        self.journal = None
+        self._compact()
+        log.info("Disk cache loaded %d entries (%d bytes) from %s",
+                 len(self.entries), self.current_bytes, self.directory)
+
+    def _compact(self):
+        index_path = os.path.join(self.directory, "index")
+        with open(index_path + ".tmp", "w", encoding="utf-8") as output:
+            for (key, entry) in self.entries.items():
+                output.write(f"put\t{entry.expires_at}\t{entry.size}\t{entry.head_length}\t{entry.digest}\t{key}\n")
+        os.replace(index_path + ".tmp", index_path)
+        if self.journal is not None:
+            self.journal.close()
+        self.journal = open(index_path, "a", encoding="utf-8")
+        self.journal_records = len(self.entries)
+
+#the request headers the cached responses of a URL vary on, as told by their Vary header
+class VaryIndex(object):
+    """
+    get(key) returns the header names (lowercase, sorted) the last
+    response stored for the cache key varied on, such a response is
+    cached under vary_cache_key and not under key itself. Keys whose
+    responses don't vary aren't kept, at most max_entries are (the
+    least recently used are forgotten, their responses are missed
+    until the next one is stored).
+
+    The index is local to the process, a worker sharing the cache
+    misses once before it finds the variants the others stored.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        # key -> header names, least recently used first
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            names = self.entries.get(key)
+            if names is not None:
+                self.entries.move_to_end(key)
+            return names
+
+    def set(self, key, names):
+        with self.lock:
+            if len(names) == 0:
+                self.entries.pop(key, None)
+                return
+            self.entries[key] = names
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries)}
+
+#builds the compressed variants of cached responses on background threads
+class ResponseCompressor(object):
+    """
+    submit(key, encoding) asks for the variant of the fresh cached
+    response of key in encoding (one of encodings). A thread builds
+    it with compress_response and caches it under variant_cache_key
+    until the response itself expires.
+
+    A job already waiting for the same variant isn't queued again,
+    at most max_pending jobs wait (dropped counts the refused ones),
+    and a response not worth compressing isn't tried again while
+    it is fresh.
+    """
+
+    def __init__(self, cache, level=6, min_bytes=1024, threads=1, max_pending=256, max_skipped=4096):
+        self.cache = cache
+        self.level = level
+        self.min_bytes = min_bytes
+        self.encodings = ("br", "gzip") if brotli is not None else ("gzip",)
+        self.pending = set()
+        # (key, encoding) -> time.monotonic() value until which it isn't tried again
+        self.skipped = OrderedDict()
+        self.max_skipped = max_skipped
+        self.compressed = 0
+        self.dropped = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.lock = threading.Lock()
+        self.jobs = queue.Queue(max_pending)
+        for index in range(threads):
+            threading.Thread(target=self._run, name=f"compressor-{index}", daemon=True).start()
+
+    def submit(self, key, encoding):
+        job = (key, encoding)
+        with self.lock:
+            if job in self.pending:
+                return False
+            until = self.skipped.get(job)
+            if until is not None:
+                if until > time.monotonic():
+                    return False
+                del self.skipped[job]
+            try:
+                self.jobs.put_nowait(job)
+            except queue.Full:
+                self.dropped += 1
+                return False
+            self.pending.add(job)
+        return True
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                self._compress(*job)
+            except Exception:
+                log.exception("Compressing %s failed", job[0])
+                self._skip(job, self.cache.default_ttl)
+            finally:
+                with self.lock:
+                    self.pending.discard(job)
+
+    def _compress(self, key, encoding):
+        stale = self.cache.get_stale(key)
+        if stale is None:
+            return
+        try:
+            response = bytes(stale[0])
+        finally:
+            self.cache.release(stale[0])
+        ttl = -stale[1]
+        if ttl <= 0:
+            return
+        compressed = compress_response(response, encoding, self.level, self.min_bytes)
+        if compressed is None:
+            self._skip((key, encoding), ttl)
+            return
+        if self.cache.put(variant_cache_key(key, encoding), compressed, ttl):
+            with self.lock:
+                self.compressed += 1
+                self.bytes_in += len(response)
+                self.bytes_out += len(compressed)
+
+    def _skip(self, job, seconds):
+        with self.lock:
+            self.skipped[job] = time.monotonic() + seconds
+            self.skipped.move_to_end(job)
+            while len(self.skipped) > self.max_skipped:
+                self.skipped.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {"compressed": self.compressed, "dropped": self.dropped,
+                    "bytes_in": self.bytes_in, "bytes_out": self.bytes_out}
+
+#a fetch that is currently running for a key, shared by every thread asking for the same key
+class InFlightCall(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+#single-flight for threads: concurrent callers with the same key share one call
+class SingleFlight(object):
+    """
+    The first caller of do() for a key runs the given function,
+    callers arriving while it runs wait for it and get the same
+    result (or exception) instead of running it again.
+
+    do() returns (result, shared), shared is True for the callers
+    that got the result of another caller's call.
+
+    shared counts the callers that were served by another caller's call.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.shared = 0
+        self.lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = InFlightCall()
+                self.calls[key] = call
+            else:
+                self.shared += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return (call.result, True)
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return (call.result, False)
+
+#single-flight for the asyncio engine, same as SingleFlight but waiting on futures
+class AsyncSingleFlight(object):
+    def __init__(self):
+        self.calls = {}
+        self.shared = 0
+
+    async def do(self, key, coro_fn):
+        future = self.calls.get(key)
+        if future is not None:
+            self.shared += 1
+            return (await asyncio.shield(future), True)
+        future = asyncio.get_running_loop().create_future()
+        self.calls[key] = future
+        try:
+            result = await coro_fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # mark it retrieved, nobody may be waiting for it
+            future.exception()
+            raise
         else:
-            print("NOT IMPLEMENTED")
-            return HttpRequestState.INVALID_INPUT
-    listoflists.append(listofheaders)
-    print(f"List of Lists: {listoflists}")
-    return listoflists
+            future.set_result(result)
+        finally:
+            del self.calls[key]
+        return (result, False)
+
+#cached resolution of the origin host names, shared by the clients of an engine
+class HostResolver(object):
+    """
+    resolve(host, port) (or await resolve_async(host, port)) returns
+    the (family, sockaddr) list of host. Answers are cached for ttl
+    seconds and failures for negative_ttl seconds (the error is raised
+    again without a lookup). Concurrent lookups of one name share a
+    single call of lookup, socket.getaddrinfo unless another function
+    with its signature is given (e.g. a stub resolver in tests).
+    resolve_async runs lookup in the loop's executor.
+
+    getaddrinfo doesn't tell the TTL of the records, so ttl is a setting.
+    """
+
+    def __init__(self, ttl, negative_ttl, max_entries=4096, lookup=socket.getaddrinfo):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.lookup = lookup
+        # (host, port) -> (expires at, addresses, error), oldest first
+        self.entries = OrderedDict()
+        self.flights = SingleFlight()
+        self.async_flights = AsyncSingleFlight()
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        self.lock = threading.Lock()
+
+    def resolve(self, host, port):
+        key = (host, int(port))
+        entry = self._cached(key)
+        if entry is None:
+            entry, shared = self.flights.do(key, lambda: self._store(key, self._lookup(key)))
+        return self._answer(entry)
+
+    async def resolve_async(self, host, port):
+        key = (host, int(port))
+        entry = self._cached(key)
+        if entry is None:
+            loop = asyncio.get_running_loop()
+
+            async def lookup():
+                return self._store(key, await loop.run_in_executor(None, self._lookup, key))
+
+            entry, shared = await self.async_flights.do(key, lookup)
+        return self._answer(entry)
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits,
+                    "misses": self.misses, "failures": self.failures}
+
+    def _cached(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry
+
+    def _lookup(self, key):
+        started = time.perf_counter()
+        try:
+            infos = self.lookup(key[0], key[1], 0, socket.SOCK_STREAM)
+            return ([(info[0], info[4]) for info in infos], None)
+        except OSError as e:
+            return (None, e)
+        finally:
+            metrics.observe("proxy_dns_lookup_seconds", time.perf_counter() - started)
+
+    def _store(self, key, answer):
+        addresses, error = answer
+        ttl = self.ttl if error is None else self.negative_ttl
+        entry = (time.monotonic() + ttl, addresses, error)
+        with self.lock:
+            if error is not None:
+                self.failures += 1
+            if ttl > 0:
+                self.entries.pop(key, None)
+                self.entries[key] = entry
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return entry
+
+    def _answer(self, entry):
+        expires_at, addresses, error = entry
+        if error is not None:
+            # a new exception each time, the cached one may be raised by several threads at once
+            raise type(error)(*error.args)
+        return addresses
+
+#finds where one HTTP/1.x response ends in the bytes read from an upstream connection
+class HttpResponseFramer(object):
+    """
+    Feed it the bytes read from the connection, in order.
+
+    feed() returns how many of the given bytes belong to the
+    response, done tells if the response is complete and
+    keep_alive (valid once done) if the connection may be used
+    for another request.
+
+    The body length comes from (in order) the request method and
+    status code (HEAD, 1xx, 204, 304 have none), chunked
+    Transfer-Encoding, Content-Length, or the connection closing
+    (call finish() when it does).
+    """
+
+    def __init__(self, request_method="GET"):
+        self.request_method = request_method
+        self.head = bytearray()
+        self.head_done = False
+        self.code = 0
+        self.headers = []
+        self.done = False
+        self.keep_alive = False
+        self.remaining = 0
+        self.chunked = False
+        self.until_close = False
+        # chunked decoding state: "size", "data" or "trailer"
+        self.chunk_state = "size"
+        self.line = bytearray()
+
+    def feed(self, data):
+        consumed = 0
+        while not self.head_done:
+            search_from = max(0, len(self.head) - 3)
+            self.head += data[consumed:]
+            head_end = self.head.find(b"\r\n\r\n", search_from)
+            if head_end == -1:
+                return len(data)
+            extra = len(self.head) - (head_end + 4)
+            consumed = len(data) - extra
+            del self.head[head_end + 4:]
+            self._start_body()
+        if self.done:
+            return consumed
+        return consumed + self._feed_body(data[consumed:])
+
+    def finish(self):
+        """
+        The connection was closed by the origin.
+        """
+        if self.until_close:
+            self.done = True
+        self.keep_alive = False
+
+    def _start_body(self):
+        self.code, self.headers = parse_http_response_head(self.head)
+        if 100 <= self.code < 200 and self.code != 101:
+            # interim response, the real one follows it
+            self.head.clear()
+            return
+        self.head_done = True
+        connection = (get_header(self.headers, "Connection") or "").lower()
+        if self.head.startswith(b"HTTP/1.1"):
+            self.keep_alive = "close" not in connection
+        else:
+            self.keep_alive = "keep-alive" in connection
+        framing = response_body_framing(self.request_method, self.code, self.headers)
+        if framing == "none":
+            self.done = True
+        elif framing == "chunked":
+            self.chunked = True
+        elif framing == "length":
+            self.remaining = int(get_header(self.headers, "Content-Length"))
+            self.done = self.remaining == 0
+        else:
+            self.until_close = True
+            self.keep_alive = False
+
+    def _feed_body(self, data):
+        if self.until_close:
+            return len(data)
+        if not self.chunked:
+            used = min(self.remaining, len(data))
+            self.remaining -= used
+            self.done = self.remaining == 0
+            return used
+        i = 0
+        while i < len(data) and not self.done:
+            if self.chunk_state == "data":
+                used = min(self.remaining, len(data) - i)
+                i += used
+                self.remaining -= used
+                if self.remaining == 0:
+                    self.chunk_state = "size"
+                continue
+            line_end = data.find(b"\n", i)
+            if line_end == -1:
+                self.line += data[i:]
+                return len(data)
+            self.line += data[i:line_end + 1]
+            i = line_end + 1
+            line = bytes(self.line).strip()
+            self.line.clear()
+            if self.chunk_state == "size":
+                size = int(line.split(b";")[0], 16)
+                if size == 0:
+                    self.chunk_state = "trailer"
+                else:
+                    # the chunk data and its trailing CRLF
+                    self.remaining = size + 2
+                    self.chunk_state = "data"
+            elif len(line) == 0:
+                self.done = True
+        return i
+
+#finds the end of a request body, the body half of HttpResponseFramer
+class HttpRequestBodyFramer(HttpResponseFramer):
+    """
+    framing comes from request_body_framing, feed() the bytes
+    following the request head: it returns how many belong to
+    the body, done tells if the body is complete.
+    """
+
+    def __init__(self, framing, content_length=0):
+        super().__init__()
+        self.head_done = True
+        if framing == "chunked":
+            self.chunked = True
+        else:
+            self.remaining = content_length
+            self.done = content_length == 0
+
+#removes the chunked framing of a body as it comes, for clients that don't understand it
+class ChunkedBodyDecoder(HttpRequestBodyFramer):
+    """
+    feed() the body bytes in order, it returns the chunk data in
+    them as memoryview slices (the sizes, CRLFs and trailers are
+    left out), done tells if the last chunk went through.
+    """
+
+    LINE_SCAN_BYTES = 1024
+
+    def __init__(self):
+        super().__init__("chunked")
+
+    def feed(self, data):
+        parts = []
+        view = memoryview(data)
+        i = 0
+        while i < len(view) and not self.done:
+            if self.chunk_state == "data":
+                # the chunk data, then its trailing CRLF
+                data_left = self.remaining - 2
+                used = min(self.remaining, len(view) - i)
+                if data_left > 0:
+                    parts.append(view[i:i + min(data_left, used)])
+                i += used
+                self.remaining -= used
+                if self.remaining == 0:
+                    self.chunk_state = "size"
+                continue
+            # size and trailer lines are short, only look for their end near i
+            scanned = bytes(view[i:i + self.LINE_SCAN_BYTES])
+            line_end = scanned.find(b"\n")
+            if line_end == -1:
+                self.line += scanned
+                i += len(scanned)
+                continue
+            self.line += scanned[:line_end + 1]
+            i += line_end + 1
+            line = bytes(self.line).strip()
+            self.line.clear()
+            if self.chunk_state == "size":
+                size = int(line.split(b";")[0], 16)
+                if size == 0:
+                    self.chunk_state = "trailer"
+                else:
+                    self.remaining = size + 2
+                    self.chunk_state = "data"
+            elif len(line) == 0:
+                self.done = True
+        return parts
+
+#fixes the hop-by-hop headers of a response on its way to the client
+class ClientResponseRewriter(object):
+    """
+    Feed it the response bytes in order, it returns the buffers to
+    send to the client: the head with its Connection/Keep-Alive
+    headers replaced by our own "Connection" header, then the
+    body untouched. The body is never copied, only the first
+    HEAD_SCAN_BYTES of a feed are searched for the end of the head.
+
+    keep_alive: known once the head went through, True if the
+    client asked for a persistent connection and the response
+    does not need the connection to be closed to end its body.
+
+    vary_encoding: the proxy compresses responses, Accept-Encoding
+    is added to the Vary header of the compressible ones.
+
+    byte_range: the range the client asked for (see parse_byte_range)
+    and if_range its If-Range header. A 200 with a Content-Length it
+    applies to is turned into a 206 (or 416) and only the asked
+    bytes of its body are returned, as memoryview slices.
+
+    dechunk: the client speaks HTTP/1.0, a chunked body is decoded
+    (see ChunkedBodyDecoder) and ended by closing the connection.
+    """
+
+    HEAD_SCAN_BYTES = 16384
+
+    def __init__(self, keep_alive_requested, request_method="GET", vary_encoding=False, byte_range=None, if_range=None, dechunk=False):
+        self.keep_alive_requested = keep_alive_requested
+        self.request_method = request_method
+        self.vary_encoding = vary_encoding
+        self.head = bytearray()
+        self.head_done = False
+        self.keep_alive = False
+        # status code and headers of the response and bytes handed out, for the access log
+        self.code = 0
+        self.headers = HttpHeaders()
+        self.sent_bytes = 0
+        self.byte_range = byte_range
+        self.if_range = if_range
+        # [start, end) of the body to send, None to send all of it
+        self.window = None
+        self.body_offset = 0
+        self.dechunk = dechunk
+        # set once the head showed a chunked body to decode
+        self.decoder = None
+
+    def feed(self, data):
+        if self.head_done:
+            if self.window is not None:
+                return self._slice(data)
+            if self.decoder is not None:
+                return self._decode(data)
+            self.sent_bytes += len(data)
+            return [data]
+        held = len(self.head)
+        search_from = max(0, held - 3)
+        self.head += data[:self.HEAD_SCAN_BYTES]
+        head_end = self.head.find(b"\r\n\r\n", search_from)
+        if head_end == -1 and len(data) > self.HEAD_SCAN_BYTES:
+            self.head += data[self.HEAD_SCAN_BYTES:]
+            head_end = self.head.find(b"\r\n\r\n", search_from)
+        if head_end == -1:
+            return []
+        self.head_done = True
+        head = self._rewrite_head(bytes(self.head[:head_end]))
+        self.head.clear()
+        # the body starts in data, after what was held back from earlier feeds
+        rest = memoryview(data)[head_end + 4 - held:]
+        if self.window is not None:
+            self.sent_bytes += len(head)
+            return [head] + self._slice(rest)
+        if self.decoder is not None:
+            self.sent_bytes += len(head)
+            return [head] + self._decode(rest)
+        self.sent_bytes += len(head) + len(rest)
+        if len(rest) == 0:
+            return [head]
+        return [head, rest]
+
+    def body_window(self, length):
+        """
+        The [start, end) part of a body of length bytes to send, for
+        callers sending the body themselves once the head went
+        through feed().
+        """
+        if self.window is None:
+            return (0, length)
+        return (min(self.window[0], length), min(self.window[1], length))
+
+    def _decode(self, data):
+        parts = self.decoder.feed(data)
+        self.sent_bytes += sum(len(part) for part in parts)
+        return parts
+
+    def _slice(self, data):
+        start = max(self.window[0] - self.body_offset, 0)
+        end = min(self.window[1] - self.body_offset, len(data))
+        self.body_offset += len(data)
+        if start >= end:
+            return []
+        self.sent_bytes += end - start
+        return [memoryview(data)[start:end]]
+
+    def flush(self):
+        """
+        Returns what is still held back (a response without a
+        complete head), the connection can't be kept alive then.
+        """
+        pending = bytes(self.head)
+        self.head.clear()
+        self.head_done = True
+        self.sent_bytes += len(pending)
+        return pending
+
+    def _rewrite_head(self, head):
+        code, headers = parse_http_response_head(head)
+        self.code = code
+        self.headers = headers
+        framing = response_body_framing(self.request_method, code, headers)
+        dropped = set(HOP_BY_HOP_HEADERS)
+        if self.dechunk and framing == "chunked":
+            # the decoded body ends when the connection closes
+            self.decoder = ChunkedBodyDecoder()
+            framing = "close"
+            dropped.update(("transfer-encoding", "content-length"))
+        self.keep_alive = self.keep_alive_requested and framing != "close"
+        connection = get_header(headers, "Connection")
+        if connection is not None:
+            dropped.update(token.strip().lower() for token in connection.split(","))
+        vary = None
+        if self.vary_encoding and response_compressible(self.request_method, code, headers):
+            vary = vary_accept_encoding(get_header(headers, "Vary"))
+            dropped.add("vary")
+        lines = head.split(b"\r\n")
+        rewritten = [lines[0]]
+        added = []
+        if (self.byte_range is not None and code == 200 and framing == "length"
+                and if_range_matches(self.if_range, headers)):
+            total = int(get_header(headers, "Content-Length"))
+            version = lines[0].split(b" ", 1)[0]
+            dropped.add("content-length")
+            self.window = resolve_byte_range(self.byte_range, total)
+            if self.window is None:
+                self.code = 416
+                self.window = (0, 0)
+                rewritten[0] = version + b" 416 Range Not Satisfiable"
+                added = [b"Content-Range: bytes */%d" % total, b"Content-Length: 0"]
+            else:
+                self.code = 206
+                rewritten[0] = version + b" 206 Partial Content"
+                added = [b"Content-Range: bytes %d-%d/%d" % (self.window[0], self.window[1] - 1, total),
+                         b"Content-Length: %d" % (self.window[1] - self.window[0])]
+        for line in lines[1:]:
+            name = line.split(b":", 1)[0].strip().decode("iso-8859-1").lower()
+            if name not in dropped:
+                rewritten.append(line)
+        rewritten += added
+        if vary is not None:
+            rewritten.append(b"Vary: " + vary.encode("iso-8859-1"))
+        rewritten.append(b"Connection: keep-alive" if self.keep_alive else b"Connection: close")
+        return b"\r\n".join(rewritten) + b"\r\n\r\n"
+
+#idle persistent upstream connections, keyed by (host, port)
+class UpstreamConnectionPool(object):
+    """
+    Connections are opaque to the pool, close_connection is
+    called for the ones it drops (expired or over the limits).
+
+    take() hands out the most recently used idle connection
+    of a key, put() gives a connection back after a complete
+    response.
+    """
+
+    def __init__(self, max_idle, max_per_host, idle_timeout, close_connection):
+        self.max_idle = max_idle
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.close_connection = close_connection
+        self.idle = {}
+        self.total_idle = 0
+        self.reused = 0
+        self.lock = threading.Lock()
+
+    def take(self, key):
+        expired = []
+        now = time.monotonic()
+        conn = None
+        with self.lock:
+            conns = self.idle.get(key)
+            while conns:
+                candidate, idle_since = conns.pop()
+                self.total_idle -= 1
+                if now - idle_since < self.idle_timeout:
+                    conn = candidate
+                    self.reused += 1
+                    break
+                expired.append(candidate)
+        for candidate in expired:
+            self.close_connection(candidate)
+        return conn
+
+    def put(self, key, conn):
+        expired = []
+        now = time.monotonic()
+        with self.lock:
+            for conns in self.idle.values():
+                while conns and now - conns[0][1] >= self.idle_timeout:
+                    expired.append(conns.popleft()[0])
+                    self.total_idle -= 1
+            conns = self.idle.setdefault(key, deque())
+            if len(conns) < self.max_per_host and self.total_idle < self.max_idle:
+                conns.append((conn, now))
+                self.total_idle += 1
+            else:
+                expired.append(conn)
+        for candidate in expired:
+            self.close_connection(candidate)
+
+    def stats(self):
+        with self.lock:
+            return {"idle": self.total_idle, "reused": self.reused}
+
+#one direction of a CONNECT tunnel: the bytes read from one side and not written to the other yet
+class TunnelBuffer(object):
+    """
+    The buffer is allocated once and refilled with recv_into(),
+    view[start:end] is what is still to be written. eof is set
+    once the reading side closed its half, shut once the writing
+    side was told, total counts the bytes written.
+    """
+
+    def __init__(self, size, pending=b""):
+        self.buffer = bytearray(max(size, len(pending)))
+        self.view = memoryview(self.buffer)
+        self.view[:len(pending)] = pending
+        self.start = 0
+        self.end = len(pending)
+        self.eof = False
+        self.shut = False
+        self.total = 0
+
+#time limits of one exchange with an origin, each wait on it asks for its own
+class UpstreamTimeouts(object):
+    """
+    connect, first_byte and chunk (the wait for each following chunk)
+    bound a single wait, deadline bounds the whole exchange: no wait
+    lasts past it. A limit of 0 means none.
+
+    timeout(phase) gives the timeout of the next wait (None for none),
+    expired() the ProxyTimeout to raise when that wait timed out.
+    """
+
+    def __init__(self, connect, first_byte, chunk, deadline):
+        self.limits = {"connect": connect, "first byte": first_byte, "chunk": chunk}
+        self.deadline = time.monotonic() + deadline if deadline > 0 else None
+        self.phase = "connect"
+        # True if the deadline is nearer than the limit of the phase
+        self.capped = False
+
+    def timeout(self, phase):
+        self.phase = phase
+        limit = self.limits[phase] if self.limits[phase] > 0 else None
+        self.capped = False
+        if self.deadline is not None:
+            remaining = self.deadline - time.monotonic()
+            if remaining <= 0:
+                self.capped = True
+                raise self.expired()
+            if limit is None or remaining < limit:
+                limit = remaining
+                self.capped = True
+        return limit
+
+    def expired(self):
+        phase = "request deadline" if self.capped else "upstream " + self.phase
+        metrics.inc("proxy_timeouts_total", labels=(("phase", phase),))
+        return ProxyTimeout(phase, 504)
+
+#fixed set of threads serving the accepted client connections, with a bounded queue in front of them
+class ClientWorkerPool(object):
+    """
+    submit() hands a job to the threads, which call handler(job).
+    At most max_queued jobs wait for a busy thread, when the queue
+    is full shed_policy picks the job refused: "reject" refuses the
+    new one, "drop-oldest" the one that waited longest (so the jobs
+    served are the freshest ones). submit() returns the refused job,
+    or None, and the caller answers it without tying up a thread.
+    """
+
+    SHED_POLICIES = ("reject", "drop-oldest")
+
+    def __init__(self, size, max_queued, handler, shed_policy="reject"):
+        if shed_policy not in self.SHED_POLICIES:
+            raise ValueError(f"unknown shed policy {shed_policy!r}")
+        self.size = size
+        self.max_queued = max_queued
+        self.handler = handler
+        self.shed_policy = shed_policy
+        # (job, time it was submitted), the oldest first
+        self.jobs = deque()
+        self.busy = 0
+        self.shed = 0
+        self.condition = threading.Condition()
+
+    def start(self):
+        for index in range(self.size):
+            threading.Thread(target=self._run, name=f"client-worker-{index}", daemon=True).start()
+
+    def submit(self, job):
+        with self.condition:
+            if self._queued() < self.max_queued:
+                self.jobs.append((job, time.perf_counter()))
+                self.condition.notify()
+                return None
+            self.shed += 1
+            if self.shed_policy == "reject" or len(self.jobs) == 0:
+                return job
+            self.jobs.append((job, time.perf_counter()))
+            return self.jobs.popleft()[0]
+
+    def queued(self):
+        """ Number of jobs waiting for a busy thread. """
+        with self.condition:
+            return self._queued()
+
+    def _queued(self):
+        return max(0, len(self.jobs) - (self.size - self.busy))
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while len(self.jobs) == 0:
+                    self.condition.wait()
+                job, submitted_at = self.jobs.popleft()
+                self.busy += 1
+            metrics.observe("proxy_accept_queue_wait_seconds", time.perf_counter() - submitted_at)
+            try:
+                self.handler(job)
+            except Exception:
+                log.exception("Client worker failed")
+            finally:
+                with self.condition:
+                    self.busy -= 1
+
+    def stats(self):
+        with self.condition:
+            return {"busy": self.busy, "queued": self._queued(), "shed": self.shed}
+
+#shared state of a running proxy, handed to every client handler
+class ProxyContext(object):
+    """
+    config: the ProxyConfig.
+
+    cache: the ResponseCache.
+
+    flights: SingleFlight (or AsyncSingleFlight) coalescing cache misses.
+
+    pool: UpstreamConnectionPool, None if upstream keep-alive is off.
+
+    disk_cache: DiskCache below the cache, None if there is none.
+
+    resolver: HostResolver of the origin host names, None to let
+    connect() resolve them.
+
+    client_pool: ClientWorkerPool serving the clients of the threaded
+    engine, None for the asyncio engine.
+
+    compressor: ResponseCompressor building the compressed variants
+    of the cached responses, None if compression is off.
+
+    vary: VaryIndex of the cached responses that vary on request
+    headers, None to store none of them.
+    """
+
+    def __init__(self, config, cache, flights, pool, disk_cache=None, resolver=None, client_pool=None, compressor=None, vary=None):
+        self.config = config
+        self.cache = cache
+        self.flights = flights
+        self.pool = pool
+        self.disk_cache = disk_cache
+        self.resolver = resolver
+        self.client_pool = client_pool
+        self.compressor = compressor
+        self.vary = vary
+
+#queue handler that leaves the formatting of the records to the writer thread
+class LazyQueueHandler(QueueHandler):
+    """
+    Only enqueues the record, so a logging call on the hot path
+    costs the record creation and nothing else. The arguments
+    of the records must not be mutated after the call.
+    """
+
+    def prepare(self, record):
+        return record
+
+#background thread writing the records queued by a LazyQueueHandler in batches
+class BatchingLogWriter(object):
+    """
+    Formats and writes every record waiting in the queue at once,
+    with a single flush per batch (at most max_batch records).
+    """
+
+    def __init__(self, log_queue, stream, formatter, max_batch=512):
+        self.log_queue = log_queue
+        self.stream = stream
+        self.formatter = formatter
+        self.max_batch = max_batch
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.log_queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            batch = [self.log_queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.log_queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            for record in batch:
+                if record is None:
+                    continue
+                try:
+                    lines.append(self.formatter.format(record) + "\n")
+                except Exception as e:
+                    lines.append(f"unformattable log record {record.msg!r}: {e}\n")
+            self.stream.write("".join(lines))
+            self.stream.flush()
+            if batch[-1] is None:
+                return
+
+#histogram buckets (seconds) used when none are given
+DEFAULT_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+#counters, gauges and histograms rendered in the Prometheus text format
+class MetricsRegistry(object):
+    """
+    describe() a metric once, then inc() counters/gauges (a gauge
+    is a counter that also goes down) and observe() histograms.
+    Labels are a tuple of (name, value) pairs.
+
+    Updates go to the shard of the calling thread, shards are
+    handed out round-robin and each has its own lock, so threads
+    rarely wait on each other. snapshot() sums the shards and adds
+    what the collectors (functions returning (name, labels, value)
+    tuples, for values kept elsewhere) report, render() formats
+    the snapshot, merged with those of other processes if given.
+    """
+
+    SHARDS = 16
+
+    def __init__(self):
+        self.descriptions = {}
+        self.buckets = {}
+        self.reset()
+
+    #drops every value and collector, the descriptions stay
+    def reset(self):
+        self.shards = [({}, threading.Lock()) for i in range(self.SHARDS)]
+        self.next_shard = itertools.count()
+        self.local = threading.local()
+        self.collectors = []
+
+    def describe(self, name, kind, help_text, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.descriptions[name] = (kind, help_text)
+        if kind == "histogram":
+            self.buckets[name] = buckets
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def _shard(self):
+        shard = getattr(self.local, "shard", None)
+        if shard is None:
+            shard = self.shards[next(self.next_shard) % self.SHARDS]
+            self.local.shard = shard
+        return shard
+
+    def inc(self, name, amount=1, labels=()):
+        values, lock = self._shard()
+        key = (name, labels)
+        with lock:
+            values[key] = values.get(key, 0) + amount
+
+    def observe(self, name, value, labels=()):
+        bounds = self.buckets[name]
+        values, lock = self._shard()
+        key = (name, labels)
+        with lock:
+            histogram = values.get(key)
+            if histogram is None:
+                # one count per bucket, then +Inf, then the sum
+                histogram = [0] * (len(bounds) + 1) + [0.0]
+                values[key] = histogram
+            histogram[bisect.bisect_left(bounds, value)] += 1
+            histogram[-1] += value
+
+    def snapshot(self):
+        totals = {}
+        for (values, lock) in self.shards:
+            with lock:
+                items = list(values.items())
+            merge_metric_values(totals, items)
+        for collector in self.collectors:
+            merge_metric_values(totals, [((name, labels), value) for (name, labels, value) in collector()])
+        return totals
+
+    def render(self, snapshots=()):
+        totals = self.snapshot()
+        for snapshot in snapshots:
+            merge_metric_values(totals, snapshot.items())
+        lines = []
+        for name in sorted(set(key[0] for key in totals)):
+            kind, help_text = self.descriptions.get(name, ("untyped", name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (key, value) in sorted((k, v) for (k, v) in totals.items() if k[0] == name):
+                labels = key[1]
+                if kind != "histogram":
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+                    continue
+                cumulative = 0
+                for (bound, count) in zip(self.buckets[name] + (float("inf"),), value[:-1]):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {value[-1]}")
+                lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+#a worker process as seen by the supervisor
+class WorkerProcess(object):
+    def __init__(self, index, pid, control_socket):
+        self.index = index
+        self.pid = pid
+        # supervisor end of the socketpair used to ask for the worker's metrics
+        self.control_socket = control_socket
+        self.responsive = True
+        self.started_at = time.monotonic()
+
+#adds (key, value) metric items into totals, histograms are added bucket by bucket
+def merge_metric_values(totals, items):
+    for (key, value) in items:
+        if isinstance(value, list):
+            total = totals.setdefault(key, [0] * len(value))
+            for i in range(len(value)):
+                total[i] += value[i]
+        else:
+            totals[key] = totals.get(key, 0) + value
+
+#done
+def load_proxy_config(environ=None) -> ProxyConfig:
+    """
+    Builds a ProxyConfig from the defaults, overriding
+    a field "x" by the environment variable PROXY_X if it is set.
+    The value is converted to the type of the default value.
+    """
+    environ = os.environ if environ is None else environ
+    config = ProxyConfig()
+    for (name, default) in vars(config).items():
+        value = environ.get("PROXY_" + name.upper())
+        if value is None:
+            continue
+        if isinstance(default, bool):
+            value = value.lower() in ("1", "true", "yes", "on")
+        else:
+            value = type(default)(value)
+        setattr(config, name, value)
+    return config
+
+#response statuses that may be cached without explicit freshness information
+CACHEABLE_STATUS_CODES = {200, 203, 300, 301, 404, 410}
+
+#splits the status line and headers of a raw upstream response, headers as a list of lists like the requests
+def parse_http_response_head(response):
+    """
+    returns:
+    (status code, headers) where the status code is 0
+    if the status line can't be read.
+    """
+    head_end = response.find(b"\r\n\r\n")
+    head = response if head_end == -1 else response[:head_end]
+    lines = bytes(head).decode("iso-8859-1").split("\r\n")
+    status_line = lines[0].split(" ")
+    try:
+        code = int(status_line[1])
+    except (IndexError, ValueError):
+        return (0, HttpHeaders())
+    headers = HttpHeaders()
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers.append([name.strip(), value.strip()])
+    return (code, headers)
+
+#finds the value of a header (case-insensitive) in a list of lists, None if missing
+def get_header(headers, name):
+    name = name.lower()
+    for header in headers:
+        if header[0].lower() == name:
+            return header[1]
+    return None
+
+#how the end of a response body is found: "none", "chunked", "length" or "close" (read until the connection closes)
+def response_body_framing(request_method, code, headers):
+    if request_method == "HEAD" or 100 <= code < 200 or code in (204, 304):
+        return "none"
+    transfer_encoding = (get_header(headers, "Transfer-Encoding") or "").lower()
+    if "chunked" in transfer_encoding:
+        return "chunked"
+    content_length = get_header(headers, "Content-Length")
+    if content_length is not None and content_length.isdigit():
+        return "length"
+    return "close"
+
+#whether the client asked to keep its connection open after the response
+def client_wants_keep_alive(http : HttpRequestInfo):
+    connection = (get_header(http.headers, "Connection")
+                  or get_header(http.headers, "Proxy-Connection") or "").lower()
+    if http.http_version == "HTTP/1.1":
+        return "close" not in connection
+    return "keep-alive" in connection
+
+BYTE_RANGE = re.compile(r"\s*bytes\s*=\s*([0-9]*)\s*-\s*([0-9]*)\s*$", re.IGNORECASE)
+
+#the byte range a Range header asks for as (first, last), first is None for a suffix ("-n" gives (None, n)) and last for an open end
+def parse_byte_range(value):
+    """
+    Only a single range of bytes is served, a request for several
+    (or in another unit, or an invalid one) gets the whole response
+    as if it had no Range header: None is returned.
+    """
+    match = BYTE_RANGE.match(value or "")
+    if match is None:
+        return None
+    first, last = match.groups()
+    if len(first) == 0:
+        return (None, int(last)) if len(last) > 0 else None
+    if len(last) > 0 and int(last) < int(first):
+        return None
+    return (int(first), int(last) if len(last) > 0 else None)
+
+#the [start, end) part of a body of total bytes a byte range selects, None if it selects nothing
+def resolve_byte_range(byte_range, total):
+    first, last = byte_range
+    if first is None:
+        if last == 0 or total == 0:
+            return None
+        return (max(0, total - last), total)
+    if first >= total:
+        return None
+    return (first, total if last is None else min(last + 1, total))
+
+#whether the If-Range of a request (None if it has none) still names the response of headers, so its range applies
+def if_range_matches(if_range, headers):
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        etag = get_header(headers, "ETag")
+        # only a strong validator matches
+        return not if_range.startswith("W/") and etag is not None and etag.strip() == if_range
+    return get_header(headers, "Last-Modified") == if_range
+
+#the byte range (and If-Range) of a GET, taken off the request if the proxy fetches whole objects for ranges
+def take_byte_range(http : HttpRequestInfo, config : ProxyConfig):
+    byte_range = parse_byte_range(http.headers.get("Range")) if http.method == "GET" else None
+    if_range = http.headers.get("If-Range")
+    if byte_range is not None and config.range_cache_fill:
+        http.headers.remove_all("Range")
+        http.headers.remove_all("If-Range")
+    return (byte_range, if_range)
+
+#the Cache-Control directives of a response as {name: value}, value is "" for a bare directive
+def cache_control_directives(headers):
+    directives = {}
+    cache_control = get_header(headers, "Cache-Control")
+    if cache_control is not None:
+        for directive in cache_control.split(","):
+            name, _, value = directive.strip().partition("=")
+            directives[name.lower()] = value.strip('"')
+    return directives
+
+#how long (seconds) a response may be served from the cache, 0 means it is stale at once
+def response_freshness_lifetime(code, headers, default_ttl):
+    """
+    Cache-Control no-store/private and no-cache leave no freshness,
+    s-maxage/max-age win over Expires and Expires wins over the
+    default ttl, which only applies to CACHEABLE_STATUS_CODES.
+    """
+    directives = cache_control_directives(headers)
+    if "no-store" in directives or "private" in directives or "no-cache" in directives:
+        return 0
+    for name in ("s-maxage", "max-age"):
+        if name in directives:
+            try:
+                return max(0, int(directives[name]))
+            except ValueError:
+                return 0
+    expires = get_header(headers, "Expires")
+    if expires is not None:
+        try:
+            expires_at = parsedate_to_datetime(expires).timestamp()
+        except (TypeError, ValueError):
+            return 0
+        date = get_header(headers, "Date")
+        try:
+            now = parsedate_to_datetime(date).timestamp() if date else time.time()
+        except (TypeError, ValueError):
+            now = time.time()
+        return max(0, expires_at - now)
+    if code in CACHEABLE_STATUS_CODES:
+        return default_ttl
+    return 0
+
+#how long (seconds) a stale response is kept for revalidation, and how much of that it may be served while revalidated
+def response_stale_lifetimes(code, headers, retention):
+    """
+    returns:
+    (retain, stale-while-revalidate) responses with an ETag or
+    Last-Modified can be revalidated and are kept retention
+    seconds, any cacheable one is kept for its stale-while-revalidate
+    window. must-revalidate/no-cache responses are never served stale.
+    """
+    directives = cache_control_directives(headers)
+    if "no-store" in directives or "private" in directives or code not in CACHEABLE_STATUS_CODES:
+        return (0, 0)
+    try:
+        stale_while_revalidate = max(0, int(directives.get("stale-while-revalidate", 0)))
+    except ValueError:
+        stale_while_revalidate = 0
+    for name in ("must-revalidate", "proxy-revalidate", "no-cache"):
+        if name in directives:
+            stale_while_revalidate = 0
+    retain = 0
+    if get_header(headers, "ETag") is not None or get_header(headers, "Last-Modified") is not None:
+        retain = retention
+    return (max(retain, stale_while_revalidate), stale_while_revalidate)
+
+#content encodings the cache keeps variants of responses in, the preferred one first
+CACHED_ENCODINGS = ("br", "gzip")
+
+#media types worth compressing, besides text/* and the +json/+xml ones
+COMPRESSIBLE_TYPES = {"application/json", "application/javascript", "application/x-javascript",
+                      "application/xml", "application/wasm", "image/svg+xml"}
+
+#a compressed variant is only kept if it saves at least this part of the body
+COMPRESSION_MIN_SAVING = 0.1
+
+#the CACHED_ENCODINGS a client accepts according to its Accept-Encoding header, the preferred one first
+def accepted_encodings(accept_encoding):
+    if not accept_encoding:
+        return []
+    qualities = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        quality = 1.0
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[name.strip().lower()] = quality
+    default = qualities.get("*", 0.0)
+    ranked = sorted(((qualities.get(encoding, default), -order, encoding)
+                     for (order, encoding) in enumerate(CACHED_ENCODINGS)), reverse=True)
+    return [encoding for (quality, order, encoding) in ranked if quality > 0]
+
+#the cache key of the variant of a response in a content encoding
+def variant_cache_key(key, encoding):
+    return key + " encoding=" + encoding
+
+#the key variant_cache_key made a variant key from, requests for any variant count as requests for it
+def variant_base_key(key):
+    return key.partition(" encoding=")[0]
+
+#whether an entry asked for frequency times may take the place of one asked for victim_frequency times
+def admits_over(frequency, victim_frequency):
+    return frequency > victim_frequency
+
+#the request headers a response varies on (lowercase, sorted, Accept-Encoding left to the encoding variants), None for "Vary: *"
+def response_vary_names(headers):
+    names = set()
+    for vary in [value for (name, value) in headers if name.lower() == "vary"]:
+        for name in vary.split(","):
+            name = name.strip().lower()
+            if name == "*":
+                return None
+            if len(name) > 0 and name != "accept-encoding":
+                names.add(name)
+    return tuple(sorted(names))
+
+#the cache key of the variant of a response for the values names have in the request headers
+def vary_cache_key(key, names, request_headers : HttpHeaders):
+    values = []
+    for name in names:
+        # whitespace around the values of repeated headers or list items doesn't matter
+        value = ",".join(item.strip() for item in ",".join(request_headers.get_all(name)).split(","))
+        values.append(name + "=" + value)
+    return key + " vary=" + "&".join(values)
+
+#the key a request looks up: its cache key, or the variant of it for its headers if the responses of the key vary
+def request_cache_key(context : ProxyContext, key, http : HttpRequestInfo):
+    names = None if context.vary is None else context.vary.get(key)
+    if names is None:
+        return key
+    return vary_cache_key(key, names, http.headers)
+
+#whether the response a fetch for key got for another client suits the request http too, as far as its Vary header tells
+def shared_response_matches(key, http : HttpRequestInfo, response):
+    code, headers = parse_http_response_head(response_head(response))
+    names = response_vary_names(headers)
+    if names is None:
+        return False
+    if len(names) == 0:
+        return True
+    # a fetch for the plain key (the Vary header was unknown then) was made for another client's headers
+    return vary_cache_key(key.partition(" vary=")[0], names, http.headers) == key
+
+#what concurrent fetches of key wait for together, the origin may answer clients accepting other encodings or asking for other ranges differently
+def origin_flight_key(key, http : HttpRequestInfo):
+    varying = (http.headers.get("Accept-Encoding"), http.headers.get("Range"), http.headers.get("If-Range"))
+    return key if varying == (None, None, None) else (key,) + varying
+
+#whether the proxy may compress a response: a 200 answer to a GET of a compressible type, not encoded yet
+def response_compressible(request_method, code, headers, min_bytes=0):
+    if request_method != "GET" or code != 200 or get_header(headers, "Content-Encoding") is not None:
+        return False
+    if "no-transform" in cache_control_directives(headers) or (get_header(headers, "Vary") or "").strip() == "*":
+        return False
+    content_length = get_header(headers, "Content-Length")
+    if content_length is not None and content_length.isdigit() and int(content_length) < min_bytes:
+        return False
+    content_type = (get_header(headers, "Content-Type") or "").split(";")[0].strip().lower()
+    return (content_type.startswith("text/") or content_type in COMPRESSIBLE_TYPES
+            or content_type.endswith("+json") or content_type.endswith("+xml"))
+
+#the Vary header of a response that depends on the Accept-Encoding of the request
+def vary_accept_encoding(vary):
+    if vary is None or vary.strip() == "":
+        return "Accept-Encoding"
+    if "accept-encoding" in [name.strip().lower() for name in vary.split(",")]:
+        return vary
+    return vary + ", Accept-Encoding"
+
+#the body of a complete response to a GET, without the chunked transfer coding
+def response_body(response):
+    head_end = response.find(b"\r\n\r\n")
+    code, headers = parse_http_response_head(response)
+    body = response[head_end + 4:]
+    framing = response_body_framing("GET", code, headers)
+    if framing == "length":
+        return bytes(body[:int(get_header(headers, "Content-Length"))])
+    if framing != "chunked":
+        return bytes(body)
+    decoded = bytearray()
+    i = 0
+    while True:
+        line_end = body.index(b"\r\n", i)
+        size = int(bytes(body[i:line_end]).split(b";")[0], 16)
+        if size == 0:
+            return bytes(decoded)
+        decoded += body[line_end + 2:line_end + 2 + size]
+        i = line_end + 2 + size + 2
+
+#compresses a body in a content encoding ("gzip", or "br" with the brotli module)
+def compress_body(body, encoding, level):
+    if encoding == "br":
+        return brotli.compress(body, quality=min(level, 11))
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(body) + compressor.flush()
+
+#the variant of an identity response compressed in encoding, None if it isn't worth it
+def compress_response(response, encoding, level, min_bytes):
+    """
+    The variant gets its own Content-Length, a weak version of the
+    ETag (its bytes differ from the identity response ones) and
+    Accept-Encoding in its Vary header.
+    """
+    code, headers = parse_http_response_head(response)
+    body = response_body(response)
+    if len(body) < min_bytes:
+        return None
+    compressed = compress_body(body, encoding, level)
+    if len(compressed) > len(body) * (1 - COMPRESSION_MIN_SAVING):
+        return None
+    replaced = {"content-length", "transfer-encoding", "content-encoding", "vary", "etag"}
+    lines = [response[:response.find(b"\r\n")]]
+    for (name, value) in headers:
+        if name.lower() not in replaced:
+            lines.append(f"{name}: {value}".encode("iso-8859-1"))
+    etag = get_header(headers, "ETag")
+    if etag is not None:
+        lines.append(("ETag: " + (etag if etag.startswith("W/") else "W/" + etag)).encode("iso-8859-1"))
+    lines.append(("Vary: " + vary_accept_encoding(get_header(headers, "Vary"))).encode("iso-8859-1"))
+    lines.append(b"Content-Encoding: " + encoding.encode("ascii"))
+    lines.append(b"Content-Length: " + str(len(compressed)).encode("ascii"))
+    return b"\r\n".join(lines) + b"\r\n\r\n" + compressed
+
+#the cached response for a client accepting encodings: a compressed variant if there is one, else the identity one
+def lookup_response(cache : ResponseCache, key, encodings):
+    for encoding in encodings:
+        response = cache.get(variant_cache_key(key, encoding), False)
+        if response is not None:
+            return response
+    return cache.get(key)
+
+#queues the compression of the identity response just sent, for the next clients accepting the encoding
+def request_compression(context : ProxyContext, http : HttpRequestInfo, key, encodings, rewriter : ClientResponseRewriter):
+    compressor = context.compressor
+    if compressor is None:
+        return
+    encoding = next((encoding for encoding in encodings if encoding in compressor.encodings), None)
+    if encoding is None or not response_compressible(http.method, rewriter.code, rewriter.headers, compressor.min_bytes):
+        return
+    if response_freshness_lifetime(rewriter.code, rewriter.headers, context.cache.default_ttl) > 0:
+        compressor.submit(key, encoding)
+
+#stores an upstream response in the cache for as long as its headers allow
+def store_response(cache : ResponseCache, key, response, disk_cache : DiskCache = None, vary : VaryIndex = None, http : HttpRequestInfo = None):
+    """
+    A response the origin encoded is stored as the variant of
+    its encoding, only clients accepting it look it up.
+
+    With a VaryIndex, a response varying on request headers is
+    stored under the vary_cache_key of the headers of http (the
+    request it answers) and one with "Vary: *" is not stored. Without
+    one, only responses that don't vary are stored.
+    """
+    code, headers = parse_http_response_head(response)
+    names = response_vary_names(headers)
+    if names is None or code == 206:
+        # a partial response isn't the object
+        return False
+    if vary is not None:
+        key = key.partition(" vary=")[0]
+        vary.set(key, names)
+        if len(names) > 0:
+            key = vary_cache_key(key, names, http.headers)
+    elif len(names) > 0:
+        return False
+    encoding = (get_header(headers, "Content-Encoding") or "identity").strip().lower()
+    if encoding != "identity":
+        if encoding not in CACHED_ENCODINGS:
+            return False
+        key = variant_cache_key(key, encoding)
+        disk_cache = None
+    ttl = response_freshness_lifetime(code, headers, cache.default_ttl)
+    retain, stale_while_revalidate = response_stale_lifetimes(code, headers, cache.stale_retention)
+    if disk_cache is not None:
+        disk_cache.put(key, response, ttl)
+    return cache.put(key, response, ttl, retain)
+
+#the head of a (cached) response as bytes, without copying its body
+def response_head(response):
+    head = bytes(response[:ClientResponseRewriter.HEAD_SCAN_BYTES])
+    head_end = head.find(b"\r\n\r\n")
+    return head if head_end == -1 else head[:head_end + 4]
+
+#a copy of the client's request asking the origin whether the stored response (its headers) changed
+def conditional_request(http : HttpRequestInfo, stored_headers) -> HttpRequestInfo:
+    headers = HttpHeaders([list(header) for header in http.headers])
+    for name in ("If-None-Match", "If-Modified-Since", "If-Match", "If-Unmodified-Since", "If-Range", "Range"):
+        headers.remove_all(name)
+    etag = get_header(stored_headers, "ETag")
+    if etag is not None:
+        headers.append(["If-None-Match", etag])
+    last_modified = get_header(stored_headers, "Last-Modified")
+    if last_modified is not None:
+        headers.append(["If-Modified-Since", last_modified])
+    return HttpRequestInfo(http.client_address_info, http.method, http.requested_host,
+                           http.requested_port, http.requested_path, headers, http.http_version)
+
+#updates the cache with the answer to a conditional request, returns the new response (None for a 304)
+def finish_revalidation(key, context : ProxyContext, stored_code, stored_headers, response, http : HttpRequestInfo = None):
+    code, headers = parse_http_response_head(response)
+    if code != 304:
+        metrics.inc("proxy_revalidations_total", labels=(("result", "modified"),))
+        store_response(context.cache, key, response, context.disk_cache, context.vary, http)
+        return response
+    metrics.inc("proxy_revalidations_total", labels=(("result", "not_modified"),))
+    # a 304 may carry new freshness information, otherwise the stored one applies again
+    if get_header(headers, "Cache-Control") is None and get_header(headers, "Expires") is None:
+        headers = stored_headers
+    ttl = response_freshness_lifetime(stored_code, headers, context.cache.default_ttl)
+    retain, stale_while_revalidate = response_stale_lifetimes(stored_code, stored_headers, context.cache.stale_retention)
+    context.cache.refresh(key, ttl, retain)
+    return None
+
+#connects a logger to a BatchingLogWriter writing to file_name (stdout if empty)
+def attach_log_writer(logger, file_name, formatter):
+    stream = open(file_name, "a", buffering=1 << 16) if file_name else sys.stdout
+    log_queue = queue.SimpleQueue()
+    writer = BatchingLogWriter(log_queue, stream, formatter)
+    writer.start()
+    logger.addHandler(LazyQueueHandler(log_queue))
+    logger.propagate = False
+    return writer
+
+#sets up the proxy and access logs as described by the config, returns the writers
+def setup_logging(config : ProxyConfig):
+    log.setLevel(getattr(logging, config.log_level.upper(), logging.INFO))
+    writers = [attach_log_writer(log, config.log_file,
+                                 logging.Formatter("%(asctime)s %(levelname)s %(threadName)s %(message)s"))]
+    if config.access_log:
+        access_log.setLevel(logging.INFO)
+        writers.append(attach_log_writer(access_log, config.access_log_file,
+                                         logging.Formatter("ts=%(created).3f %(message)s")))
+    else:
+        access_log.disabled = True
+    return writers
+
+#counts an answered request by cache result ("hit", "disk" or "miss")
+def count_served_request(cache_status, rewriter : ClientResponseRewriter, ranged=False):
+    metrics.inc("proxy_requests_total", labels=(("cache", cache_status),))
+    if ranged:
+        metrics.inc("proxy_range_requests_total", labels=(("status", str(rewriter.code)),))
+    if cache_status not in ("miss", "bypass"):
+        metrics.inc("proxy_cache_hit_bytes_total", rewriter.sent_bytes)
+
+#one access log line per answered request, formatted later by the writer thread
+def log_access(address, http, status, sent_bytes, cache_status, started):
+    if not access_log.isEnabledFor(logging.INFO):
+        return
+    client = address[0] if address else "-"
+    if isinstance(http, HttpRequestInfo):
+        access_log.info('client=%s method=%s url="%s:%s%s" status=%s bytes=%d cache=%s ms=%.2f',
+                        client, http.method, http.requested_host, http.requested_port,
+                        http.requested_path, status, sent_bytes, cache_status,
+                        (time.perf_counter() - started) * 1000)
+    else:
+        access_log.info('client=%s method=- url=- status=%s bytes=%d cache=- ms=%.2f',
+                        client, status, sent_bytes, (time.perf_counter() - started) * 1000)
+
+#renders metric labels as {a="1",b="2"}
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for (name, value) in labels) + "}"
+
+#the metrics of this process
+metrics = MetricsRegistry()
+metrics.describe("proxy_connections_accepted_total", "counter", "Client connections accepted.")
+metrics.describe("proxy_active_connections", "gauge", "Client connections being served.")
+metrics.describe("proxy_threads", "gauge", "Live threads of the process.")
+metrics.describe("proxy_requests_total", "counter", "Requests answered, by cache result.")
+metrics.describe("proxy_error_responses_total", "counter", "Error responses sent to clients, by code.")
+metrics.describe("proxy_request_parse_seconds", "histogram", "Time spent parsing a request head.",
+                 (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.01))
+metrics.describe("proxy_upstream_connect_seconds", "histogram", "Time to connect to the origin.")
+metrics.describe("proxy_upstream_first_byte_seconds", "histogram", "Time from sending the request to the first response byte.")
+metrics.describe("proxy_cache_hits_total", "counter", "Cache lookups that found a fresh entry.")
+metrics.describe("proxy_cache_misses_total", "counter", "Cache lookups without a fresh entry.")
+metrics.describe("proxy_cache_evictions_total", "counter", "Cache entries evicted to respect the limits.")
+metrics.describe("proxy_cache_admission_rejections_total", "counter", "Responses not cached because the entries they would evict are asked for more often.")
+metrics.describe("proxy_cache_entries", "gauge", "Entries in the cache.")
+metrics.describe("proxy_cache_bytes", "gauge", "Bytes held by the cache.")
+metrics.describe("proxy_cache_hit_bytes_total", "counter", "Response bytes served from the cache.")
+metrics.describe("proxy_range_requests_total", "counter", "Requests with a usable Range header, by response status.")
+metrics.describe("proxy_vary_index_entries", "gauge", "Cache keys whose responses vary on request headers.")
+metrics.describe("proxy_request_body_bytes_total", "counter", "Request body bytes streamed to origins.")
+metrics.describe("proxy_disk_cache_hits_total", "counter", "Memory cache misses found in the disk cache.")
+metrics.describe("proxy_disk_cache_misses_total", "counter", "Lookups missing from the disk cache too.")
+metrics.describe("proxy_disk_cache_evictions_total", "counter", "Disk cache entries evicted to respect the quota.")
+metrics.describe("proxy_disk_cache_dropped_writes_total", "counter", "Responses not written to disk because the writer was behind.")
+metrics.describe("proxy_disk_cache_entries", "gauge", "Entries in the disk cache.")
+metrics.describe("proxy_disk_cache_bytes", "gauge", "Bytes of the disk cache files.")
+metrics.describe("proxy_revalidations_total", "counter", "Conditional requests for stale cache entries, by result.")
+metrics.describe("proxy_dns_lookup_seconds", "histogram", "Time of the host name lookups that missed the DNS cache.")
+metrics.describe("proxy_dns_cache_hits_total", "counter", "Host names resolved from the DNS cache.")
+metrics.describe("proxy_dns_cache_misses_total", "counter", "Host names missing from the DNS cache.")
+metrics.describe("proxy_dns_failures_total", "counter", "Host name lookups that failed.")
+metrics.describe("proxy_dns_cache_entries", "gauge", "Entries of the DNS cache.")
+metrics.describe("proxy_coalesced_dns_lookups_total", "counter", "Lookups served by a concurrent lookup of the same name.")
+metrics.describe("proxy_compressed_variants_total", "counter", "Compressed variants of cached responses built and cached.")
+metrics.describe("proxy_compression_dropped_total", "counter", "Compressions not queued because the compressor was behind.")
+metrics.describe("proxy_compression_input_bytes_total", "counter", "Bytes of the responses compressed into cached variants.")
+metrics.describe("proxy_compression_output_bytes_total", "counter", "Bytes of the compressed variants built.")
+metrics.describe("proxy_tunnels_total", "counter", "CONNECT tunnels established.")
+metrics.describe("proxy_active_tunnels", "gauge", "CONNECT tunnels open.")
+metrics.describe("proxy_tunnel_bytes_total", "counter", "Bytes relayed through CONNECT tunnels, by direction.")
+metrics.describe("proxy_timeouts_total", "counter", "Waits on clients and origins that ran out of time, by phase.")
+metrics.describe("proxy_client_threads", "gauge", "Threads serving the clients of the threaded engine.")
+metrics.describe("proxy_client_threads_busy", "gauge", "Client threads serving a connection.")
+metrics.describe("proxy_accept_queue_length", "gauge", "Accepted clients waiting for a client thread.")
+metrics.describe("proxy_accept_queue_capacity", "gauge", "Most accepted clients allowed to wait for a client thread.")
+metrics.describe("proxy_accept_queue_wait_seconds", "histogram", "Time an accepted client waited for a client thread.")
+metrics.describe("proxy_shed_connections_total", "counter", "Clients answered 503 because the accept queue was full, by shed policy.")
+metrics.describe("proxy_upstream_pool_idle", "gauge", "Idle pooled upstream connections.")
+metrics.describe("proxy_upstream_pool_reused_total", "counter", "Requests sent on a reused upstream connection.")
+metrics.describe("proxy_coalesced_requests_total", "counter", "Cache misses served by another request's upstream fetch.")
+metrics.describe("proxy_workers", "gauge", "Live worker processes.")
+metrics.describe("proxy_worker_restarts_total", "counter", "Worker processes forked again after dying.")
+
+#reports the state kept by the context objects (cache, pool, single-flight) at scrape time
+def register_context_metrics(context : ProxyContext):
+    def collect():
+        stats = context.cache.stats()
+        collected = [("proxy_cache_hits_total", (), stats["hits"]),
+                     ("proxy_cache_misses_total", (), stats["misses"]),
+                     ("proxy_cache_evictions_total", (), stats["evictions"]),
+                     ("proxy_cache_admission_rejections_total", (), stats["rejections"]),
+                     ("proxy_coalesced_requests_total", (), context.flights.shared),
+                     ("proxy_threads", (), threading.active_count())]
+        # the supervisor reports the size of a cache shared by the workers, once
+        if not (context.config.shared_cache_file and context.config.workers > 1):
+            collected.append(("proxy_cache_entries", (), stats["entries"]))
+            collected.append(("proxy_cache_bytes", (), stats["bytes"]))
+        if context.disk_cache is not None:
+            disk_stats = context.disk_cache.stats()
+            collected += [("proxy_disk_cache_hits_total", (), disk_stats["hits"]),
+                          ("proxy_disk_cache_misses_total", (), disk_stats["misses"]),
+                          ("proxy_disk_cache_evictions_total", (), disk_stats["evictions"]),
+                          ("proxy_disk_cache_dropped_writes_total", (), disk_stats["dropped_writes"]),
+                          ("proxy_disk_cache_entries", (), disk_stats["entries"]),
+                          ("proxy_disk_cache_bytes", (), disk_stats["bytes"])]
+        if context.resolver is not None:
+            dns_stats = context.resolver.stats()
+            collected += [("proxy_dns_cache_hits_total", (), dns_stats["hits"]),
+                          ("proxy_dns_cache_misses_total", (), dns_stats["misses"]),
+                          ("proxy_dns_failures_total", (), dns_stats["failures"]),
+                          ("proxy_dns_cache_entries", (), dns_stats["entries"]),
+                          ("proxy_coalesced_dns_lookups_total", (),
+                           context.resolver.flights.shared + context.resolver.async_flights.shared)]
+        if context.compressor is not None:
+            compressor_stats = context.compressor.stats()
+            collected += [("proxy_compressed_variants_total", (), compressor_stats["compressed"]),
+                          ("proxy_compression_dropped_total", (), compressor_stats["dropped"]),
+                          ("proxy_compression_input_bytes_total", (), compressor_stats["bytes_in"]),
+                          ("proxy_compression_output_bytes_total", (), compressor_stats["bytes_out"])]
+        if context.vary is not None:
+            collected.append(("proxy_vary_index_entries", (), context.vary.stats()["entries"]))
+        if context.client_pool is not None:
+            client_stats = context.client_pool.stats()
+            collected += [("proxy_client_threads", (), context.client_pool.size),
+                          ("proxy_client_threads_busy", (), client_stats["busy"]),
+                          ("proxy_accept_queue_length", (), client_stats["queued"]),
+                          ("proxy_accept_queue_capacity", (), context.client_pool.max_queued),
+                          ("proxy_shed_connections_total", (("policy", context.client_pool.shed_policy),), client_stats["shed"])]
+        if context.pool is not None:
+            pool_stats = context.pool.stats()
+            collected.append(("proxy_upstream_pool_idle", (), pool_stats["idle"]))
+            collected.append(("proxy_upstream_pool_reused_total", (), pool_stats["reused"]))
+        return collected
+    metrics.add_collector(collect)
+
+#counts an error response sent to a client
+def count_error_response(code):
+    metrics.inc("proxy_error_responses_total", labels=(("code", str(code)),))
+
+#serves /metrics on its own port from a background thread, if the config enables it
+def setup_metrics_socket(config : ProxyConfig, render=metrics.render):
+    if config.metrics_port <= 0:
+        return
+    metrics_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    metrics_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    metrics_socket.bind((config.bind_host, int(config.metrics_port)))
+    metrics_socket.listen(8)
+    log.info("Serving metrics on port: %s", config.metrics_port)
+    start_new_thread(do_metrics_socket_logic, (metrics_socket, render))
+
+#answers scrapes one at a time, they are rare and cheap
+def do_metrics_socket_logic(metrics_socket : socket, render):
+    while True:
+        client_socket, address = metrics_socket.accept()
+        try:
+            client_socket.settimeout(5.0)
+            parser = HttpRequestParser(address)
+            if not read_client_request(client_socket, parser, 4096):
+                continue
+            if parser.request is not None and parser.request.requested_path == "/metrics":
+                status = b"200 OK"
+                body = render().encode("utf-8")
+            else:
+                status = b"404 Not Found"
+                body = b"only /metrics is served here\n"
+            client_socket.sendall(b"HTTP/1.1 " + status + b"\r\n"
+                                  b"Content-Type: text/plain; version=0.0.4\r\n"
+                                  b"Content-Length: " + str(len(body)).encode("ascii") + b"\r\n"
+                                  b"Connection: close\r\n\r\n" + body)
+        except OSError as e:
+            log.debug("Metrics scrape from %s failed: %s", address, e)
+        finally:
+            client_socket.close()
+
+#starts the clock of a new exchange with an origin
+def create_upstream_timeouts(config : ProxyConfig) -> UpstreamTimeouts:
+    return UpstreamTimeouts(config.upstream_connect_timeout, config.upstream_first_byte_timeout,
+                            config.upstream_chunk_timeout, config.request_deadline)
+
+#builds the ResponseCompressor of the cache, None if compression is off
+def create_response_compressor(config : ProxyConfig, cache : ResponseCache) -> ResponseCompressor:
+    if not config.compression:
+        return None
+    return ResponseCompressor(cache, config.compression_level, config.compression_min_bytes, config.compression_threads)
+
+#builds the HostResolver described by the config
+def create_host_resolver(config : ProxyConfig) -> HostResolver:
+    return HostResolver(config.dns_cache_ttl, config.dns_negative_ttl, config.dns_cache_max_entries)
+
+#builds the DiskCache described by the config, None if it has no disk cache directory
+def create_disk_cache(config : ProxyConfig) -> DiskCache:
+    if not config.disk_cache_dir:
+        return None
+    return DiskCache(config.disk_cache_dir, config.disk_cache_max_bytes, config.cache_default_ttl)
+
+#builds the ResponseCache described by the config
+def create_response_cache(config : ProxyConfig) -> ResponseCache:
+    admission = FrequencySketch(config.cache_max_entries) if config.cache_admission else None
+    if config.shared_cache_file:
+        return SharedResponseCache(config.shared_cache_file, config.cache_max_bytes,
+                                   config.cache_max_entries, config.cache_default_ttl,
+                                   config.shared_cache_slab_size, config.cache_stale_retention, admission)
+    return ResponseCache(config.cache_max_bytes, config.cache_max_entries,
+                         config.cache_default_ttl, config.cache_stale_retention, admission)
+
+#fetches a response from the origin and caches it, run once per key by the SingleFlight
+def fetch_and_store(http : HttpRequestInfo, key, context : ProxyContext, client_socket : socket = None, rewriter : ClientResponseRewriter = None):
+    """
+    Without a client_socket the whole response is buffered and returned.
+
+    With a client_socket the response is streamed to it, and returned
+    only if it was small enough to be kept for the cache (None otherwise).
+    """
+    config = context.config
+    max_tee_bytes = min(config.stream_cache_max_bytes, context.cache.max_bytes)
+    response = setup_server_socket(http, client_socket, config.chunk_size, max_tee_bytes, context.pool, rewriter, context.resolver, create_upstream_timeouts(config))
+    if response is not None:
+        store_response(context.cache, key, response, context.disk_cache, context.vary, http)
+    return response
+
+#gets a response missing from the cache, streaming or buffering it as configured, and sends it to the client
+def serve_from_origin(http : HttpRequestInfo, key, context : ProxyContext, client_socket : socket, rewriter : ClientResponseRewriter):
+    flights = context.flights
+    if not context.config.stream_responses:
+        response, shared = flights.do(origin_flight_key(key, http), lambda: fetch_and_store(http, key, context))
+        if shared and not shared_response_matches(key, http, response):
+            response = fetch_and_store(http, key, context)
+        send_to_client(client_socket, rewriter, response)
+        return
+    response, shared = flights.do(origin_flight_key(key, http), lambda: fetch_and_store(http, key, context, client_socket, rewriter))
+    if not shared:
+        # we were the leader, the response is already streamed to our client
+        return
+    if response is None or not shared_response_matches(key, http, response):
+        # the leader's response was too big to be shared, or varies on headers we don't share, fetch our own copy
+        fetch_and_store(http, key, context, client_socket, rewriter)
+        return
+    send_to_client(client_socket, rewriter, response)
+
+#sends response bytes to the client, through the rewriter of the client connection if there is one
+def send_to_client(client_socket : socket, rewriter : ClientResponseRewriter, data):
+    parts = [data] if rewriter is None else rewriter.feed(data)
+    send_parts(client_socket, parts)
+
+#answers with a stale cached response, returns the cache status for the access log
+def serve_stale(http : HttpRequestInfo, key, context : ProxyContext, client_socket : socket, rewriter : ClientResponseRewriter, stale):
+    """
+    Within its stale-while-revalidate window the response is sent
+    at once and revalidated in the background ("stale"). Otherwise
+    a conditional request is made first: on 304 the stored response
+    is sent ("revalidated"), else the new one ("miss"). If the
+    origin can't be reached the stale response is sent.
+
+    The stale response is released during the conditional request,
+    a pinned shared cache entry could not be replaced.
+    """
+    response, stale_for = stale
+    stored_code, stored_headers = parse_http_response_head(response_head(response))
+    retain, stale_while_revalidate = response_stale_lifetimes(stored_code, stored_headers, context.cache.stale_retention)
+    flight_key = ("revalidate", origin_flight_key(key, http))
+    if stale_for < stale_while_revalidate:
+        if flight_key not in context.flights.calls:
+            start_new_thread(revalidate_in_background, (http, key, context, stored_code, stored_headers))
+        send_to_client(client_socket, rewriter, response)
+        return "stale"
+    context.cache.release(response)
+    cache_status = "revalidated"
+    try:
+        fresh, shared = context.flights.do(flight_key, lambda: revalidate(http, key, context, stored_code, stored_headers))
+    except OSError as e:
+        metrics.inc("proxy_revalidations_total", labels=(("result", "error"),))
+        log.warning("Revalidating %s failed, serving it stale: %s", key, e)
+        fresh = None
+        cache_status = "stale"
+    if fresh is not None:
+        send_to_client(client_socket, rewriter, fresh)
+        return "miss"
+    cached = context.cache.get_stale(key)
+    if cached is None:
+        # evicted in the meantime
+        serve_from_origin(http, key, context, client_socket, rewriter)
+        return "miss"
+    try:
+        send_to_client(client_socket, rewriter, cached[0])
+    finally:
+        context.cache.release(cached[0])
+    return cache_status
+
+#sends the conditional request for a stale entry and updates the cache, returns the new response (None for a 304)
+def revalidate(http : HttpRequestInfo, key, context : ProxyContext, stored_code, stored_headers):
+    request = conditional_request(http, stored_headers)
+    response = setup_server_socket(request, None, context.config.chunk_size, None, context.pool, None, context.resolver, create_upstream_timeouts(context.config))
+    return finish_revalidation(key, context, stored_code, stored_headers, response, http)
+
+#runs in its own thread, refreshing an entry that was served stale
+def revalidate_in_background(http : HttpRequestInfo, key, context : ProxyContext, stored_code, stored_headers):
+    try:
+        context.flights.do(("revalidate", origin_flight_key(key, http)), lambda: revalidate(http, key, context, stored_code, stored_headers))
+    except OSError as e:
+        metrics.inc("proxy_revalidations_total", labels=(("result", "error"),))
+        log.warning("Background revalidation of %s failed: %s", key, e)
+
+#sends a response of the disk cache: the head through the rewriter, the body with sendfile()
+def send_stored_response(client_socket : socket, rewriter : ClientResponseRewriter, stored):
+    stored_file, entry = stored
+    cork = hasattr(socket, "TCP_CORK")
+    try:
+        # corked, the head and the start of the body leave in the same segments
+        if cork:
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+        send_to_client(client_socket, rewriter, stored_file.read(entry.head_length))
+        start, end = rewriter.body_window(entry.size - entry.head_length)
+        if rewriter.decoder is not None:
+            # the body needs decoding, it can't go straight from the file
+            for data in iter(lambda: stored_file.read(65536), b""):
+                send_to_client(client_socket, rewriter, data)
+        elif end > start:
+            client_socket.sendfile(stored_file, entry.head_length + start, end - start)
+            rewriter.sent_bytes += end - start
+    finally:
+        if cork:
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
+        stored_file.close()
+
+#sends buffers in order, sendmsg() gathers them without joining them first
+def send_parts(client_socket : socket, parts):
+    parts = [part for part in parts if len(part) > 0]
+    while len(parts) > 1:
+        sent = client_socket.sendmsg(parts)
+        while sent > 0 and sent >= len(parts[0]):
+            sent -= len(parts.pop(0))
+        if sent > 0:
+            parts[0] = memoryview(parts[0])[sent:]
+    if len(parts) == 1:
+        client_socket.sendall(parts[0])
+
+#builds the shared state of the threaded engine
+def create_proxy_context(config : ProxyConfig) -> ProxyContext:
+    pool = None
+    if config.upstream_keep_alive:
+        pool = UpstreamConnectionPool(config.pool_max_idle, config.pool_max_per_host,
+                                      config.pool_idle_timeout, lambda conn: conn.close())
+    cache = create_response_cache(config)
+    context = ProxyContext(config, cache, SingleFlight(), pool, create_disk_cache(config),
+                           create_host_resolver(config), compressor=create_response_compressor(config, cache),
+                           vary=VaryIndex(config.cache_max_entries))
+    register_context_metrics(context)
+    return context
+
+#the key a request is cached under, equivalent URLs get the same one
+def get_cache_key(http : HttpRequestInfo, config : ProxyConfig = None):
+    """
+    The host is case-folded without a trailing dot and the default
+    port left out, the path goes through normalize_url_path and the
+    query through normalize_url_query (see the cache_key_* settings
+    of the config), a fragment is dropped.
+    """
+    host = http.requested_host.rstrip(".")
+    if ":" in host:
+        host = "[" + host + "]"
+    if int(http.requested_port) != 80:
+        host += ":" + str(http.requested_port)
+    path, question, query = http.requested_path.partition("#")[0].partition("?")
+    key = host + normalize_url_path(path)
+    if len(question) > 0:
+        if config is None:
+            query = normalize_url_query(query)
+        else:
+            ignored = [name.strip() for name in config.cache_key_ignored_params.split(",") if name.strip()]
+            query = normalize_url_query(query, config.cache_key_sort_query, ignored)
+        if len(query) > 0:
+            key += "?" + query
+    return key
+
+#characters percent-encoding changes nothing for (RFC 3986 2.3)
+UNRESERVED_CHARACTERS = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~")
+
+PERCENT_ENCODED = re.compile(r"%([0-9A-Fa-f]{2})")
+
+#decodes the percent-encoded unreserved characters and upper-cases the other escapes
+def normalize_percent_encoding(text):
+    if "%" not in text:
+        return text
+    def normalize(match):
+        character = chr(int(match.group(1), 16))
+        return character if character in UNRESERVED_CHARACTERS else "%" + match.group(1).upper()
+    return PERCENT_ENCODED.sub(normalize, text)
+
+#a URL path with normalized escapes and without "." and ".." segments (RFC 3986 5.2.4)
+def normalize_url_path(path):
+    path = normalize_percent_encoding(path)
+    if not path.startswith("/"):
+        path = "/" + path
+    if "/." not in path:
+        return path
+    segments = path.split("/")[1:]
+    output = []
+    for (i, segment) in enumerate(segments):
+        last = i == len(segments) - 1
+        if segment == "." or segment == "..":
+            if segment == ".." and len(output) > 0:
+                output.pop()
+            if last:
+                output.append("")
+        else:
+            output.append(segment)
+    return "/" + "/".join(output)
+
+#a URL query with normalized escapes, its parameters sorted by name (repeated ones keep their order) and the ignored ones removed
+def normalize_url_query(query, sort=True, ignored=()):
+    """
+    ignored: parameter names, a name ending with "*" matches
+    every parameter starting with the rest of it.
+    """
+    params = []
+    for param in query.split("&"):
+        if len(param) == 0:
+            continue
+        param = normalize_percent_encoding(param)
+        name = param.partition("=")[0]
+        if any(name.startswith(pattern[:-1]) if pattern.endswith("*") else name == pattern for pattern in ignored):
+            continue
+        params.append((name, param))
+    if sort:
+        params.sort(key=lambda param: param[0])
+    return "&".join(param for (name, param) in params)
+
+#done
+def entry_point(proxy_port_number):
+    """
+    Entry point, start your code here.
+
+    Please don't delete this function,
+    but feel free to modify the code
+    inside it.
+    """
+    config = load_proxy_config()
+    if(config.workers > 1):
+        run_supervisor(proxy_port_number, config)
+        return
+    setup_logging(config)
+    setup_metrics_socket(config)
+    run_engine(proxy_port_number, config)
+
+    pass
+
+#serves clients in this process with the engine the config selects
+def run_engine(proxy_port_number, config : ProxyConfig):
+    if(config.engine == "asyncio"):
+        setup_async_sockets(proxy_port_number, config)
+    else:
+        setup_sockets(proxy_port_number, config)
+
+#done
+def setup_server_socket(http_request_obj : HttpRequestInfo, client_socket : socket = None, chunk_size=4096, max_tee_bytes=None, pool : UpstreamConnectionPool = None, rewriter : ClientResponseRewriter = None, resolver : HostResolver = None, timeouts : UpstreamTimeouts = None):
+    if pool is not None:
+        return do_pooled_server_socket_logic(pool, http_request_obj, client_socket, chunk_size, max_tee_bytes, rewriter, resolver, timeouts)
+    required_host = http_request_obj.requested_host
+    required_port = http_request_obj.requested_port
+    family = socket.AF_INET
+    if resolver is not None:
+        family, sockaddr = resolver.resolve(required_host, required_port)[0]
+        required_host = sockaddr[0]
+    server_socket = socket.socket(family, socket.SOCK_STREAM)
+    request_byte_arr = http_request_obj.to_bytes()
+    response = do_server_socket_logic(server_socket,required_host,required_port,request_byte_arr,client_socket,chunk_size,max_tee_bytes,rewriter,timeouts)
+    
+    return response
+
+#connects to an origin, trying each of its addresses in turn
+def connect_upstream(host, port, resolver : HostResolver = None, timeouts : UpstreamTimeouts = None):
+    if resolver is None:
+        try:
+            return socket.create_connection((host, port), None if timeouts is None else timeouts.timeout("connect"))
+        except socket.timeout:
+            if timeouts is None:
+                raise
+            raise timeouts.expired() from None
+    error = None
+    for (family, sockaddr) in resolver.resolve(host, port):
+        server_socket = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            connect_socket(server_socket, sockaddr, timeouts)
+            return server_socket
+        except OSError as e:
+            server_socket.close()
+            error = e
+    raise error
+
+#connects a socket to an origin address within the connect timeout
+def connect_socket(server_socket : socket, address, timeouts : UpstreamTimeouts = None):
+    try:
+        if timeouts is not None:
+            server_socket.settimeout(timeouts.timeout("connect"))
+        server_socket.connect(address)
+    except socket.timeout:
+        if timeouts is None:
+            raise
+        raise timeouts.expired() from None
+
+#sends a request to an origin, the wait counts in the first byte timeout
+def send_upstream(server_socket : socket, data, timeouts : UpstreamTimeouts = None):
+    try:
+        if timeouts is not None:
+            server_socket.settimeout(timeouts.timeout("first byte"))
+        server_socket.sendall(data)
+    except socket.timeout:
+        if timeouts is None:
+            raise
+        raise timeouts.expired() from None
+
+#receives from an origin within the timeout of phase ("first byte" or "chunk")
+def recv_upstream(server_socket : socket, chunk_size, timeouts : UpstreamTimeouts = None, phase="chunk"):
+    try:
+        if timeouts is not None:
+            server_socket.settimeout(timeouts.timeout(phase))
+        return server_socket.recv(chunk_size)
+    except socket.timeout:
+        if timeouts is None:
+            raise
+        raise timeouts.expired() from None
+
+#coroutine version of connect_upstream, returns the (reader, writer) pair
+async def connect_upstream_async(host, port, resolver : HostResolver = None, timeouts : UpstreamTimeouts = None):
+    if resolver is None:
+        return await wait_upstream(asyncio.open_connection(host, port), timeouts, "connect")
+    error = None
+    for (family, sockaddr) in await resolver.resolve_async(host, port):
+        try:
+            return await wait_upstream(asyncio.open_connection(sockaddr[0], sockaddr[1]), timeouts, "connect")
+        except OSError as e:
+            error = e
+    raise error
+
+#awaits a step of an exchange with an origin within the timeout of its phase, asyncio version of the helpers above
+async def wait_upstream(awaitable, timeouts : UpstreamTimeouts, phase):
+    if timeouts is None:
+        return await awaitable
+    try:
+        limit = timeouts.timeout(phase)
+    except ProxyTimeout:
+        awaitable.close()
+        raise
+    try:
+        return await asyncio.wait_for(awaitable, limit)
+    except asyncio.TimeoutError:
+        raise timeouts.expired() from None
+
+#done
+def do_server_socket_logic(server_socket : socket, required_host: str ,required_port : int, request_byte_arr, client_socket : socket, chunk_size=4096, max_tee_bytes=None, rewriter : ClientResponseRewriter = None, timeouts : UpstreamTimeouts = None):
+    log.debug("upstream %s:%s", required_host, required_port)
+    try:
+        started = time.perf_counter()
+        connect_socket(server_socket, (required_host,int(required_port)), timeouts)
+        sent_at = time.perf_counter()
+        metrics.observe("proxy_upstream_connect_seconds", sent_at - started)
+        send_upstream(server_socket, request_byte_arr, timeouts)
+        if client_socket is not None:
+            return relay_server_response(server_socket, client_socket, chunk_size, max_tee_bytes, rewriter, sent_at, timeouts)
+        response = bytearray()
+        while True:
+            http_response = recv_upstream(server_socket, chunk_size, timeouts, "first byte" if len(response) == 0 else "chunk")
+            if(len(response) == 0):
+                metrics.observe("proxy_upstream_first_byte_seconds", time.perf_counter() - sent_at)
+            response += http_response
+            if(len(http_response) == 0):
+                break
+    finally:
+        server_socket.close()
+
+    return response
+
+#same as do_server_socket_logic over a persistent HTTP/1.1 connection taken from (and given back to) the pool
+def do_pooled_server_socket_logic(pool : UpstreamConnectionPool, http_request_obj : HttpRequestInfo, client_socket : socket, chunk_size, max_tee_bytes, rewriter : ClientResponseRewriter = None, resolver : HostResolver = None, timeouts : UpstreamTimeouts = None, body=None):
+    """
+    body: the request body as an iterable of chunks, sent after the
+    head. It can only be read once, so such a request always goes
+    over a new connection (pool may be None then) and isn't retried.
+    """
+    key = (http_request_obj.requested_host, int(http_request_obj.requested_port))
+    request_byte_arr = http_request_obj.to_keep_alive_bytes()
+    while True:
+        server_socket = pool.take(key) if (pool is not None and body is None) else None
+        reused = server_socket is not None
+        if not reused:
+            started = time.perf_counter()
+            server_socket = connect_upstream(key[0], key[1], resolver, timeouts)
+            metrics.observe("proxy_upstream_connect_seconds", time.perf_counter() - started)
+        tee = bytearray() if (client_socket is None or max_tee_bytes) else None
+        framer = HttpResponseFramer(http_request_obj.method)
+        received = 0
+        try:
+            send_upstream(server_socket, request_byte_arr, timeouts)
+            if body is not None:
+                for part in body:
+                    send_upstream(server_socket, part, timeouts)
+            sent_at = time.perf_counter()
+            while not framer.done:
+                chunk = recv_upstream(server_socket, chunk_size, timeouts, "first byte" if received == 0 else "chunk")
+                if(len(chunk) == 0):
+                    framer.finish()
+                    break
+                if received == 0:
+                    metrics.observe("proxy_upstream_first_byte_seconds", time.perf_counter() - sent_at)
+                received += len(chunk)
+                used = framer.feed(chunk)
+                if used < len(chunk):
+                    # bytes after the end of the response, don't trust the connection
+                    framer.keep_alive = False
+                    chunk = chunk[:used]
+                if client_socket is not None:
+                    send_to_client(client_socket, rewriter, chunk)
+                if tee is not None:
+                    tee += chunk
+                    if client_socket is not None and len(tee) > max_tee_bytes:
+                        tee = None
+        except ProxyTimeout:
+            # a slow origin isn't retried, the timeouts are spent
+            server_socket.close()
+            raise
+        except OSError:
+            server_socket.close()
+            if reused and received == 0:
+                # the origin closed the idle connection, retry on a new one
+                continue
+            raise
+        if reused and received == 0:
+            server_socket.close()
+            continue
+        if framer.done and framer.keep_alive and pool is not None:
+            pool.put(key, server_socket)
+        else:
+            server_socket.close()
+        return tee
+
+#forwards the upstream response chunk by chunk, the blocking sendall gives backpressure from slow clients
+def relay_server_response(server_socket : socket, client_socket : socket, chunk_size, max_tee_bytes, rewriter : ClientResponseRewriter = None, sent_at=None, timeouts : UpstreamTimeouts = None):
+    """
+    returns:
+    the full response if it stayed under max_tee_bytes
+    (so it can be cached), None otherwise.
+    """
+    tee = bytearray() if max_tee_bytes else None
+    phase = "first byte"
+    while True:
+        chunk = recv_upstream(server_socket, chunk_size, timeouts, phase)
+        phase = "chunk"
+        if sent_at is not None:
+            metrics.observe("proxy_upstream_first_byte_seconds", time.perf_counter() - sent_at)
+            sent_at = None
+        if(len(chunk) == 0):
+            break
+        send_to_client(client_socket, rewriter, chunk)
+        if tee is not None:
+            tee += chunk
+            if len(tee) > max_tee_bytes:
+                tee = None
+    return tee
+
+#done
+def setup_sockets(proxy_port_number, config : ProxyConfig = None):
+    """
+    Socket logic MUST NOT be written in the any
+    class. Classes know nothing about the sockets.
+
+    But feel free to add your own classes/functions.
+
+    Feel free to delete this function.
+    """
+    log.info("Starting HTTP proxy on port: %s", proxy_port_number)
+    
+    config = ProxyConfig() if config is None else config
+    proxy_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    do_socket_logic(proxy_socket,proxy_port_number,config)
+   
+    pass
+
+#do socket logic of Proxy, client TCP Connection, basically get the HTTP request and call Http_request_pipeline here and stay on the loop
+def do_socket_logic(proxy_socket: socket,proxy_port_number, config : ProxyConfig):
+    """
+    Example function for some helper logic, in case you
+    want to be tidy and avoid stuffing the main function.
+
+    Feel free to delete this function.
+    """
+
+    if(config.workers > 1):
+        proxy_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    proxy_socket.bind((config.bind_host,int(proxy_port_number)))
+    proxy_socket.listen(config.backlog)
+    context = create_proxy_context(config)
+    context.client_pool = ClientWorkerPool(config.client_threads, config.accept_queue_depth,
+                                           lambda job: handle_client(job[0], context, job[1]),
+                                           config.shed_policy)
+    context.client_pool.start()
+    while True:
+        client_socket, address =  proxy_socket.accept()
+        log.debug("Started conn with %s", address)
+        metrics.inc("proxy_connections_accepted_total")
+        shed = context.client_pool.submit((client_socket, address))
+        if shed is not None:
+            shed_client(shed[0], shed[1])
+    proxy_socket.close()
+
+    pass
+
+#answers a client refused by the ClientWorkerPool with a 503, without blocking the accept loop
+def shed_client(client_socket : socket, address):
+    http = HttpErrorResponse(503, "Service Unavailable")
+    try:
+        client_socket.send(http.to_byte_array(http.to_http_string()), socket.MSG_DONTWAIT)
+    except OSError:
+        pass
+    finally:
+        client_socket.close()
+    count_error_response(http.code)
+    log.debug("Shed conn with %s", address)
+
+# add your logic here, this is called during threading
+def handle_client(client_socket,context : ProxyContext, address):
+    """
+    Serves the requests of one client connection, one after the
+    other (pipelined requests wait in the parser), until the client
+    closes it, goes idle, hits the request limit or a response
+    requires closing it.
+    """
+    config = context.config
+    client_socket.settimeout(config.client_idle_timeout)
+    parser = HttpRequestParser(address, config.max_request_head_bytes)
+    served = 0
+    metrics.inc("proxy_active_connections")
+    try:
+        #get http raw data from telnet's input, whatever follows a request stays for the next one
+        while served < config.client_max_requests and read_client_request(client_socket, parser, config.chunk_size, config.client_header_timeout):
+            served += 1
+            # clients waiting for a thread get this one sooner if the connection isn't kept alive
+            last = served >= config.client_max_requests or (context.client_pool is not None and context.client_pool.queued() > 0)
+            if not serve_client_request(client_socket, context, parser, last):
+                break
+            parser.reset()
+    except socket.timeout:
+        pass
+    except ProxyTimeout as e:
+        try:
+            send_timeout_response(client_socket, address, None, e, time.perf_counter())
+        except OSError:
+            pass
+    except OSError as e:
+        log.warning("Client %s failed: %s", address, e)
+    finally:
+        client_socket.close()
+        metrics.inc("proxy_active_connections", -1)
+    log.debug("Finished %s after %d requests", address, served)
+
+#feeds the parser from the client until it holds a full request head, False if the client closed first
+def read_client_request(client_socket : socket, parser : HttpRequestParser, chunk_size, header_timeout=0):
+    """
+    Once the head started to arrive, the rest of it must arrive
+    within header_timeout seconds (0 for no limit), else
+    ProxyTimeout is raised.
+    """
+    done = parser.done
+    idle_timeout = client_socket.gettimeout()
+    deadline = None
+    try:
+        while not done:
+            if deadline is None and header_timeout > 0 and len(parser.buffer) > 0:
+                deadline = time.monotonic() + header_timeout
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise socket.timeout()
+                client_socket.settimeout(remaining if idle_timeout is None else min(remaining, idle_timeout))
+            data = client_socket.recv(chunk_size)
+            if(len(data) == 0):
+                return False
+            done = parser.feed(data)
+    except socket.timeout:
+        if deadline is None:
+            raise
+        metrics.inc("proxy_timeouts_total", labels=(("phase", "client header"),))
+        raise ProxyTimeout("client header", 408) from None
+    finally:
+        if deadline is not None:
+            client_socket.settimeout(idle_timeout)
+    return True
+
+#answers a request that ran out of time with the error response of the ProxyTimeout
+def send_timeout_response(client_socket : socket, address, http, timeout : ProxyTimeout, started):
+    send_error_response(client_socket, address, http, timeout.to_error_response(), started)
+
+#answers a request with an HttpErrorResponse, and counts and logs it
+def send_error_response(client_socket : socket, address, http, error : HttpErrorResponse, started):
+    error_bytes = error.to_byte_array(error.to_http_string())
+    client_socket.sendall(error_bytes)
+    count_error_response(error.code)
+    log_access(address, http, error.code, len(error_bytes), "-", started)
+
+#whether the config lets CONNECT tunnels reach a port
+def tunnel_port_allowed(config : ProxyConfig, port):
+    allowed = [item.strip() for item in config.connect_ports.split(",")]
+    return "*" in allowed or str(port) in allowed
+
+#the error answered to a CONNECT to a port the config doesn't allow
+def tunnel_forbidden():
+    return HttpErrorResponse(403, "Forbidden")
+
+#counts a finished tunnel and its bytes, and logs it
+def finish_tunnel(address, http : HttpRequestInfo, upstream_bytes, downstream_bytes, started):
+    metrics.inc("proxy_tunnel_bytes_total", upstream_bytes, labels=(("direction", "upstream"),))
+    metrics.inc("proxy_tunnel_bytes_total", downstream_bytes, labels=(("direction", "downstream"),))
+    log_access(address, http, 200, downstream_bytes, "tunnel", started)
+    log.debug("Tunnel to %s:%s closed, %d bytes up, %d down", http.requested_host,
+              http.requested_port, upstream_bytes, downstream_bytes)
+
+#answers a CONNECT: connects to the requested host and relays bytes both ways, the client connection is used up
+def serve_tunnel(client_socket : socket, context : ProxyContext, parser : HttpRequestParser, http : HttpRequestInfo, started):
+    config = context.config
+    error = None
+    server_socket = None
+    if not tunnel_port_allowed(config, http.requested_port):
+        error = tunnel_forbidden()
+    else:
+        try:
+            server_socket = connect_upstream(http.requested_host, http.requested_port,
+                                             context.resolver, create_upstream_timeouts(config))
+        except ProxyTimeout as e:
+            error = e.to_error_response()
+        except OSError as e:
+            log.warning("Tunnel to %s:%s failed: %s", http.requested_host, http.requested_port, e)
+            error = HttpErrorResponse(502, "Bad Gateway")
+    if error is not None:
+        error_bytes = error.to_byte_array(error.to_http_string())
+        client_socket.sendall(error_bytes)
+        count_error_response(error.code)
+        log_access(parser.source_addr, http, error.code, len(error_bytes), "-", started)
+        return False
+    metrics.inc("proxy_tunnels_total")
+    metrics.inc("proxy_active_tunnels")
+    try:
+        client_socket.sendall(http.http_version.encode("ascii") + b" 200 Connection Established\r\n\r\n")
+        # bytes the client sent right after the CONNECT head already wait in the parser
+        up = TunnelBuffer(config.tunnel_buffer_size, parser.buffer)
+        parser.buffer.clear()
+        down = TunnelBuffer(config.tunnel_buffer_size)
+        relay_tunnel(client_socket, server_socket, up, down, config.tunnel_idle_timeout)
+    finally:
+        server_socket.close()
+        metrics.inc("proxy_active_tunnels", -1)
+    finish_tunnel(parser.source_addr, http, up.total, down.total, started)
+    return False
+
+#copies bytes both ways between the client and the origin of a tunnel until both are done or it goes idle
+def relay_tunnel(client_socket : socket, server_socket : socket, up : TunnelBuffer, down : TunnelBuffer, idle_timeout):
+    """
+    The sockets are non-blocking and polled. A side is only read
+    again once what was read from it is written to the other side,
+    so a slow reader slows its writer down without stalling the
+    other direction. A side closing its half is passed on with
+    shutdown(SHUT_WR), an error on either side ends the tunnel.
+    """
+    flows = ((client_socket, server_socket, up), (server_socket, client_socket, down))
+    poller = select.poll()
+    for sock in (client_socket, server_socket):
+        sock.setblocking(False)
+        poller.register(sock, 0)
+    try:
+        while True:
+            masks = {client_socket: 0, server_socket: 0}
+            for (source, destination, flow) in flows:
+                if flow.start < flow.end:
+                    masks[destination] |= select.POLLOUT
+                elif not flow.eof:
+                    masks[source] |= select.POLLIN
+            if masks[client_socket] == 0 and masks[server_socket] == 0:
+                return
+            for (sock, mask) in masks.items():
+                poller.modify(sock, mask)
+            if len(poller.poll(idle_timeout * 1000 if idle_timeout > 0 else None)) == 0:
+                metrics.inc("proxy_timeouts_total", labels=(("phase", "tunnel idle"),))
+                return
+            for (source, destination, flow) in flows:
+                if flow.start == flow.end and not flow.eof:
+                    try:
+                        received = source.recv_into(flow.view)
+                    except BlockingIOError:
+                        continue
+                    flow.start = 0
+                    flow.end = received
+                    flow.eof = received == 0
+                if flow.start < flow.end:
+                    try:
+                        sent = destination.send(flow.view[flow.start:flow.end])
+                    except BlockingIOError:
+                        continue
+                    flow.start += sent
+                    flow.total += sent
+                if flow.eof and not flow.shut:
+                    flow.shut = True
+                    destination.shutdown(socket.SHUT_WR)
+    except OSError as e:
+        log.debug("Tunnel ended: %s", e)
+
+#takes an "Expect: 100-continue" off an upload, True if the client waits for the interim response before sending the body
+def take_expect_continue(http : HttpRequestInfo):
+    """
+    The proxy answers it itself: the origin's interim response
+    would not reach the client through the response framer.
+    """
+    expect = http.headers.get("Expect")
+    http.headers.remove_all("Expect")
+    return http.http_version == "HTTP/1.1" and expect is not None and expect.strip().lower() == "100-continue"
+
+#the HttpRequestBodyFramer of the body of an upload
+def create_request_body_framer(http : HttpRequestInfo) -> HttpRequestBodyFramer:
+    framing = request_body_framing(http.headers)
+    content_length = int(http.headers.get("Content-Length")) if framing == "length" else 0
+    return HttpRequestBodyFramer(framing, content_length)
+
+#yields the body of the request held by the parser as it arrives from the client, what follows it stays in the parser
+def read_request_body(client_socket : socket, parser : HttpRequestParser, framer : HttpRequestBodyFramer, chunk_size):
+    data = bytes(parser.buffer)
+    parser.buffer.clear()
+    while True:
+        try:
+            used = framer.feed(data)
+        except ValueError:
+            raise ConnectionError("malformed chunked request body") from None
+        if used < len(data):
+            # the next pipelined request
+            parser.buffer += data[used:]
+        if used > 0:
+            metrics.inc("proxy_request_body_bytes_total", used)
+            yield data[:used]
+        if framer.done:
+            return
+        data = client_socket.recv(chunk_size)
+        if(len(data) == 0):
+            raise ConnectionError("client closed the connection in the request body")
+
+#streams a POST/PUT to the origin and its response back to the client, nothing is buffered whole nor cached
+def forward_upload(http : HttpRequestInfo, context : ProxyContext, client_socket : socket, parser : HttpRequestParser, rewriter : ClientResponseRewriter):
+    config = context.config
+    framer = create_request_body_framer(http)
+    if take_expect_continue(http) and not framer.done:
+        client_socket.sendall(b"HTTP/1.1 100 Continue\r\n\r\n")
+    body = read_request_body(client_socket, parser, framer, config.chunk_size)
+    do_pooled_server_socket_logic(context.pool, http, client_socket, config.chunk_size, 0, rewriter,
+                                  context.resolver, create_upstream_timeouts(config), body)
+
+#answers the request held by the parser, returns True if the connection stays open for the next one
+def serve_client_request(client_socket : socket, context : ProxyContext, parser : HttpRequestParser, last):
+    started = time.perf_counter()
+    metrics.observe("proxy_request_parse_seconds", parser.parse_seconds)
+    #the request pipeine already ran in the parser, check for error 
+    http = pipeline_result(parser.state, parser.request)
+    check = isinstance(http,HttpErrorResponse)
+    if check :
+        error_string = http.to_http_string()
+        error_bytes = http.to_byte_array(error_string)
+        client_socket.sendall(error_bytes)
+        count_error_response(http.code)
+        log_access(parser.source_addr, parser.request, http.code, len(error_bytes), "-", started)
+        return False
+    if http.method == "CONNECT":
+        return serve_tunnel(client_socket, context, parser, http, started)
+    byte_range, if_range = take_byte_range(http, context.config)
+    rewriter = ClientResponseRewriter(client_wants_keep_alive(http) and not last, http.method, context.compressor is not None,
+                                      byte_range, if_range, http.http_version == "HTTP/1.0")
+    key = request_cache_key(context, get_cache_key(http, context.config), http)
+    # ranges are served from the identity response
+    encodings = [] if byte_range is not None else accepted_encodings(http.headers.get("Accept-Encoding"))
+    cache_status = "hit"
+    try:
+        response = None
+        stored = None
+        if http.method not in BODY_METHODS:
+            response = lookup_response(context.cache, key, encodings)
+            if response is None and context.disk_cache is not None:
+                stored = context.disk_cache.get(key)
+        if http.method in BODY_METHODS:
+            cache_status = "bypass"
+            forward_upload(http, context, client_socket, parser, rewriter)
+        elif response is not None:
+            try:
+                send_to_client(client_socket, rewriter, response)
+            finally:
+                context.cache.release(response)
+        elif stored is not None:
+            cache_status = "disk"
+            send_stored_response(client_socket, rewriter, stored)
+        else:
+            stale = context.cache.get_stale(key)
+            if stale is None:
+                cache_status = "miss"
+                serve_from_origin(http, key, context, client_socket, rewriter)
+            else:
+                try:
+                    cache_status = serve_stale(http, key, context, client_socket, rewriter, stale)
+                finally:
+                    context.cache.release(stale[0])
+    except ProxyTimeout as e:
+        if rewriter.head_done:
+            # part of the response went out, closing the connection is all that's left
+            log.warning("Response to %s cut: %s", parser.source_addr, e)
+            return False
+        send_timeout_response(client_socket, parser.source_addr, http, e, started)
+        return False
+    except (OSError, ValueError) as e:
+        # the origin refused the connection, broke it or sent a malformed response
+        if rewriter.head_done:
+            log.warning("Response to %s cut: %s", parser.source_addr, e)
+            return False
+        log.warning("Origin of %s failed: %s", http.requested_host, e)
+        send_error_response(client_socket, parser.source_addr, http, HttpErrorResponse(502, "Bad Gateway"), started)
+        return False
+    pending = rewriter.flush()
+    if len(pending) > 0:
+        client_socket.sendall(pending)
+    request_compression(context, http, key, encodings, rewriter)
+    count_served_request(cache_status, rewriter, byte_range is not None)
+    log_access(parser.source_addr, http, rewriter.code, rewriter.sent_bytes,
+               cache_status, started)
+    return rewriter.keep_alive
+
+#asyncio engine, same job as setup_sockets but every client is a coroutine instead of a thread
+def setup_async_sockets(proxy_port_number, config : ProxyConfig):
+    """
+    Runs the proxy on a single asyncio event loop, which lets
+    one process hold many idle/slow clients without a thread each.
+    """
+    log.info("Starting asyncio HTTP proxy on port: %s", proxy_port_number)
+    asyncio.run(do_async_socket_logic(proxy_port_number, config))
+
+#binds the proxy with asyncio.start_server and serves forever, limiting the clients served at once
+async def do_async_socket_logic(proxy_port_number, config : ProxyConfig):
+    context = create_async_proxy_context(config)
+    limiter = asyncio.Semaphore(config.max_concurrency)
+
+    async def on_client(reader, writer):
+        metrics.inc("proxy_connections_accepted_total")
+        async with limiter:
+            await handle_client_async(reader, writer, context)
+
+    server = await asyncio.start_server(on_client, config.bind_host, int(proxy_port_number), backlog=config.backlog, limit=config.max_request_head_bytes, reuse_port=config.workers > 1)
+    async with server:
+        await server.serve_forever()
+
+#builds the shared state of the asyncio engine, pooled connections are (reader, writer) pairs
+def create_async_proxy_context(config : ProxyConfig) -> ProxyContext:
+    pool = None
+    if config.upstream_keep_alive:
+        pool = UpstreamConnectionPool(config.pool_max_idle, config.pool_max_per_host,
+                                      config.pool_idle_timeout, lambda conn: conn[1].close())
+    cache = create_response_cache(config)
+    context = ProxyContext(config, cache, AsyncSingleFlight(), pool, create_disk_cache(config),
+                           create_host_resolver(config), compressor=create_response_compressor(config, cache),
+                           vary=VaryIndex(config.cache_max_entries))
+    register_context_metrics(context)
+    return context
+
+#coroutine version of read_request_head, the StreamReader keeps pipelined bytes for the next call
+async def read_request_head_async(reader : asyncio.StreamReader, idle_timeout, header_timeout=0):
+    """
+    returns:
+    the request head, or None if the client closed the connection
+    or stayed idle, or the HttpErrorResponse of a head over the
+    limit of the reader (like HttpRequestParser does). Raises
+    ProxyTimeout if the rest of a head that started to arrive took
+    more than header_timeout seconds.
+    """
+    try:
+        first = await asyncio.wait_for(reader.readexactly(1), idle_timeout)
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+        return None
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), header_timeout if header_timeout > 0 else idle_timeout)
+    except asyncio.IncompleteReadError:
+        return None
+    except asyncio.LimitOverrunError:
+        return pipeline_result(HttpRequestState.INVALID_INPUT, None)
+    except asyncio.TimeoutError:
+        if header_timeout <= 0:
+            return None
+        metrics.inc("proxy_timeouts_total", labels=(("phase", "client header"),))
+        raise ProxyTimeout("client header", 408) from None
+    return first + head[:-4]
+
+#coroutine version of read_request_body, reads exactly the body so what follows it stays in the reader
+async def read_request_body_async(reader : asyncio.StreamReader, framer : HttpRequestBodyFramer, chunk_size, idle_timeout):
+    try:
+        while not framer.done:
+            if framer.chunked and framer.chunk_state != "data":
+                data = await asyncio.wait_for(reader.readuntil(b"\n"), idle_timeout)
+            else:
+                data = await asyncio.wait_for(reader.read(min(framer.remaining, chunk_size)), idle_timeout)
+                if(len(data) == 0):
+                    raise ConnectionError("client closed the connection in the request body")
+            framer.feed(data)
+            metrics.inc("proxy_request_body_bytes_total", len(data))
+            yield data
+    except asyncio.IncompleteReadError:
+        raise ConnectionError("client closed the connection in the request body") from None
+    except (asyncio.LimitOverrunError, ValueError):
+        raise ConnectionError("malformed chunked request body") from None
+
+#coroutine version of forward_upload
+async def forward_upload_async(http : HttpRequestInfo, context : ProxyContext, reader : asyncio.StreamReader, writer : asyncio.StreamWriter, rewriter : ClientResponseRewriter):
+    config = context.config
+    framer = create_request_body_framer(http)
+    if take_expect_continue(http) and not framer.done:
+        writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+        await writer.drain()
+    body = read_request_body_async(reader, framer, config.chunk_size, config.client_idle_timeout)
+    await fetch_pooled_upstream_async(context.pool, http, writer, config.chunk_size, 0, rewriter,
+                                      context.resolver, create_upstream_timeouts(config), body)
+
+#coroutine version of serve_tunnel
+async def serve_tunnel_async(reader : asyncio.StreamReader, writer : asyncio.StreamWriter, context : ProxyContext, address, http : HttpRequestInfo, started):
+    config = context.config
+    error = None
+    if not tunnel_port_allowed(config, http.requested_port):
+        error = tunnel_forbidden()
+    else:
+        try:
+            server_reader, server_writer = await connect_upstream_async(http.requested_host, http.requested_port,
+                                                                        context.resolver, create_upstream_timeouts(config))
+        except ProxyTimeout as e:
+            error = e.to_error_response()
+        except OSError as e:
+            log.warning("Tunnel to %s:%s failed: %s", http.requested_host, http.requested_port, e)
+            error = HttpErrorResponse(502, "Bad Gateway")
+    if error is not None:
+        error_bytes = error.to_byte_array(error.to_http_string())
+        writer.write(error_bytes)
+        await writer.drain()
+        count_error_response(error.code)
+        log_access(address, http, error.code, len(error_bytes), "-", started)
+        return False
+    metrics.inc("proxy_tunnels_total")
+    metrics.inc("proxy_active_tunnels")
+    # time.monotonic() of the last byte relayed in either direction, None once the tunnel went idle
+    activity = [time.monotonic()]
+    try:
+        writer.write(http.http_version.encode("ascii") + b" 200 Connection Established\r\n\r\n")
+        await writer.drain()
+        upstream_bytes, downstream_bytes = await asyncio.gather(
+            pump_tunnel_async(reader, server_writer, config.tunnel_buffer_size, config.tunnel_idle_timeout, activity),
+            pump_tunnel_async(server_reader, writer, config.tunnel_buffer_size, config.tunnel_idle_timeout, activity))
+    finally:
+        server_writer.close()
+        metrics.inc("proxy_active_tunnels", -1)
+    finish_tunnel(address, http, upstream_bytes, downstream_bytes, started)
+    return False
+
+#one direction of serve_tunnel_async, returns the bytes it copied
+async def pump_tunnel_async(reader : asyncio.StreamReader, writer : asyncio.StreamWriter, buffer_size, idle_timeout, activity):
+    """
+    Stops at the end of the stream (passed on with write_eof()), on
+    an error (the writer is closed, which ends the other direction
+    too) or once neither direction moved for idle_timeout seconds.
+    """
+    total = 0
+    try:
+        while True:
+            try:
+                data = await asyncio.wait_for(reader.read(buffer_size), idle_timeout if idle_timeout > 0 else None)
+            except asyncio.TimeoutError:
+                if activity[0] is not None and time.monotonic() - activity[0] < idle_timeout:
+                    continue
+                # the first direction to give up counts the timeout for both
+                if activity[0] is not None:
+                    activity[0] = None
+                    metrics.inc("proxy_timeouts_total", labels=(("phase", "tunnel idle"),))
+                writer.close()
+                return total
+            if len(data) == 0:
+                if writer.can_write_eof():
+                    writer.write_eof()
+                return total
+            if activity[0] is not None:
+                activity[0] = time.monotonic()
+            writer.write(data)
+            await writer.drain()
+            total += len(data)
+    except OSError as e:
+        log.debug("Tunnel ended: %s", e)
+        writer.close()
+        return total
+
+#coroutine version of send_timeout_response
+async def send_timeout_response_async(writer : asyncio.StreamWriter, address, http, timeout : ProxyTimeout, started):
+    await send_error_response_async(writer, address, http, timeout.to_error_response(), started)
+
+#coroutine version of send_error_response
+async def send_error_response_async(writer : asyncio.StreamWriter, address, http, error : HttpErrorResponse, started):
+    error_bytes = error.to_byte_array(error.to_http_string())
+    writer.write(error_bytes)
+    await writer.drain()
+    count_error_response(error.code)
+    log_access(address, http, error.code, len(error_bytes), "-", started)
+
+#coroutine version of send_to_client
+async def send_to_client_async(writer : asyncio.StreamWriter, rewriter : ClientResponseRewriter, data):
+    parts = [data] if rewriter is None else rewriter.feed(data)
+    parts = [part for part in parts if len(part) > 0]
+    if len(parts) > 0:
+        writer.writelines(parts)
+        await writer.drain()
+
+#background revalidations of the asyncio engine, referenced here until they finish
+background_tasks = set()
+
+#coroutine version of serve_stale
+async def serve_stale_async(http : HttpRequestInfo, key, context : ProxyContext, writer : asyncio.StreamWriter, rewriter : ClientResponseRewriter, stale):
+    response, stale_for = stale
+    stored_code, stored_headers = parse_http_response_head(response_head(response))
+    retain, stale_while_revalidate = response_stale_lifetimes(stored_code, stored_headers, context.cache.stale_retention)
+    flight_key = ("revalidate", origin_flight_key(key, http))
+    if stale_for < stale_while_revalidate:
+        if flight_key not in context.flights.calls:
+            task = asyncio.create_task(revalidate_in_background_async(http, key, context, stored_code, stored_headers))
+            background_tasks.add(task)
+            task.add_done_callback(background_tasks.discard)
+        await send_to_client_async(writer, rewriter, response)
+        return "stale"
+    context.cache.release(response)
+    cache_status = "revalidated"
+    try:
+        fresh, shared = await context.flights.do(flight_key, lambda: revalidate_async(http, key, context, stored_code, stored_headers))
+    except OSError as e:
+        metrics.inc("proxy_revalidations_total", labels=(("result", "error"),))
+        log.warning("Revalidating %s failed, serving it stale: %s", key, e)
+        fresh = None
+        cache_status = "stale"
+    if fresh is not None:
+        await send_to_client_async(writer, rewriter, fresh)
+        return "miss"
+    cached = context.cache.get_stale(key)
+    if cached is None:
+        await serve_from_origin_async(http, key, context, writer, rewriter)
+        return "miss"
+    try:
+        await send_to_client_async(writer, rewriter, cached[0])
+    finally:
+        context.cache.release(cached[0])
+    return cache_status
+
+#coroutine version of revalidate
+async def revalidate_async(http : HttpRequestInfo, key, context : ProxyContext, stored_code, stored_headers):
+    request = conditional_request(http, stored_headers)
+    response = await fetch_upstream_async(request, None, context.config.chunk_size, None, context.pool, None, context.resolver, create_upstream_timeouts(context.config))
+    return finish_revalidation(key, context, stored_code, stored_headers, response, http)
+
+#coroutine version of revalidate_in_background
+async def revalidate_in_background_async(http : HttpRequestInfo, key, context : ProxyContext, stored_code, stored_headers):
+    try:
+        await context.flights.do(("revalidate", origin_flight_key(key, http)), lambda: revalidate_async(http, key, context, stored_code, stored_headers))
+    except OSError as e:
+        metrics.inc("proxy_revalidations_total", labels=(("result", "error"),))
+        log.warning("Background revalidation of %s failed: %s", key, e)
+
+#coroutine version of send_stored_response, loop.sendfile() uses os.sendfile() on the client socket
+async def send_stored_response_async(writer : asyncio.StreamWriter, rewriter : ClientResponseRewriter, stored):
+    stored_file, entry = stored
+    try:
+        await send_to_client_async(writer, rewriter, stored_file.read(entry.head_length))
+        start, end = rewriter.body_window(entry.size - entry.head_length)
+        if rewriter.decoder is not None:
+            # the body needs decoding, it can't go straight from the file
+            for data in iter(lambda: stored_file.read(65536), b""):
+                await send_to_client_async(writer, rewriter, data)
+        elif end > start:
+            await asyncio.get_running_loop().sendfile(writer.transport, stored_file, entry.head_length + start, end - start)
+            rewriter.sent_bytes += end - start
+    finally:
+        stored_file.close()
+
+#coroutine version of setup_server_socket + do_server_socket_logic, streams to client_writer if given
+async def fetch_upstream_async(http_request_obj : HttpRequestInfo, client_writer : asyncio.StreamWriter = None, chunk_size=65536, max_tee_bytes=None, pool : UpstreamConnectionPool = None, rewriter : ClientResponseRewriter = None, resolver : HostResolver = None, timeouts : UpstreamTimeouts = None):
+    if pool is not None:
+        return await fetch_pooled_upstream_async(pool, http_request_obj, client_writer, chunk_size, max_tee_bytes, rewriter, resolver, timeouts)
+    required_host = http_request_obj.requested_host
+    required_port = http_request_obj.requested_port
+    request_byte_arr = http_request_obj.to_bytes()
+    started = time.perf_counter()
+    reader, writer = await connect_upstream_async(required_host, int(required_port), resolver, timeouts)
+    metrics.observe("proxy_upstream_connect_seconds", time.perf_counter() - started)
+    try:
+        writer.write(request_byte_arr)
+        await wait_upstream(writer.drain(), timeouts, "first byte")
+        sent_at = time.perf_counter()
+        if client_writer is None:
+            response = bytearray()
+            while True:
+                chunk = await wait_upstream(reader.read(chunk_size), timeouts, "first byte" if len(response) == 0 else "chunk")
+                if(len(response) == 0):
+                    metrics.observe("proxy_upstream_first_byte_seconds", time.perf_counter() - sent_at)
+                if(len(chunk) == 0):
+                    return response
+                response += chunk
+        return await relay_server_response_async(reader, client_writer, chunk_size, max_tee_bytes, rewriter, sent_at, timeouts)
+    finally:
+        writer.close()
+
+#coroutine version of do_pooled_server_socket_logic
+async def fetch_pooled_upstream_async(pool : UpstreamConnectionPool, http_request_obj : HttpRequestInfo, client_writer : asyncio.StreamWriter, chunk_size, max_tee_bytes, rewriter : ClientResponseRewriter = None, resolver : HostResolver = None, timeouts : UpstreamTimeouts = None, body=None):
+    key = (http_request_obj.requested_host, int(http_request_obj.requested_port))
+    request_byte_arr = http_request_obj.to_keep_alive_bytes()
+    while True:
+        conn = pool.take(key) if (pool is not None and body is None) else None
+        reused = conn is not None
+        if not reused:
+            started = time.perf_counter()
+            conn = await connect_upstream_async(key[0], key[1], resolver, timeouts)
+            metrics.observe("proxy_upstream_connect_seconds", time.perf_counter() - started)
+        reader, writer = conn
+        tee = bytearray() if (client_writer is None or max_tee_bytes) else None
+        framer = HttpResponseFramer(http_request_obj.method)
+        received = 0
+        try:
+            writer.write(request_byte_arr)
+            await wait_upstream(writer.drain(), timeouts, "first byte")
+            if body is not None:
+                async for part in body:
+                    writer.write(part)
+                    await wait_upstream(writer.drain(), timeouts, "first byte")
+            sent_at = time.perf_counter()
+            while not framer.done:
+                chunk = await wait_upstream(reader.read(chunk_size), timeouts, "first byte" if received == 0 else "chunk")
+                if(len(chunk) == 0):
+                    framer.finish()
+                    break
+                if received == 0:
+                    metrics.observe("proxy_upstream_first_byte_seconds", time.perf_counter() - sent_at)
+                received += len(chunk)
+                used = framer.feed(chunk)
+                if used < len(chunk):
+                    framer.keep_alive = False
+                    chunk = chunk[:used]
+                if client_writer is not None:
+                    await send_to_client_async(client_writer, rewriter, chunk)
+                if tee is not None:
+                    tee += chunk
+                    if client_writer is not None and len(tee) > max_tee_bytes:
+                        tee = None
+        except ProxyTimeout:
+            writer.close()
+            raise
+        except OSError:
+            writer.close()
+            if reused and received == 0:
+                continue
+            raise
+        if reused and received == 0:
+            writer.close()
+            continue
+        if framer.done and framer.keep_alive and pool is not None:
+            pool.put(key, conn)
+        else:
+            writer.close()
+        return tee
+
+#coroutine version of relay_server_response, drain() gives backpressure from slow clients
+async def relay_server_response_async(reader : asyncio.StreamReader, client_writer : asyncio.StreamWriter, chunk_size, max_tee_bytes, rewriter : ClientResponseRewriter = None, sent_at=None, timeouts : UpstreamTimeouts = None):
+    tee = bytearray() if max_tee_bytes else None
+    phase = "first byte"
+    while True:
+        chunk = await wait_upstream(reader.read(chunk_size), timeouts, phase)
+        phase = "chunk"
+        if sent_at is not None:
+            metrics.observe("proxy_upstream_first_byte_seconds", time.perf_counter() - sent_at)
+            sent_at = None
+        if(len(chunk) == 0):
+            break
+        await send_to_client_async(client_writer, rewriter, chunk)
+        if tee is not None:
+            tee += chunk
+            if len(tee) > max_tee_bytes:
+                tee = None
+    return tee
+
+#coroutine version of fetch_and_store
+async def fetch_and_store_async(http_request_obj : HttpRequestInfo, key, context : ProxyContext, client_writer : asyncio.StreamWriter = None, rewriter : ClientResponseRewriter = None):
+    config = context.config
+    max_tee_bytes = min(config.stream_cache_max_bytes, context.cache.max_bytes)
+    response = await fetch_upstream_async(http_request_obj, client_writer, config.chunk_size, max_tee_bytes, context.pool, rewriter, context.resolver, create_upstream_timeouts(config))
+    if response is not None:
+        store_response(context.cache, key, response, context.disk_cache, context.vary, http_request_obj)
+    return response
+
+#coroutine version of serve_from_origin
+async def serve_from_origin_async(http : HttpRequestInfo, key, context : ProxyContext, writer : asyncio.StreamWriter, rewriter : ClientResponseRewriter):
+    flights = context.flights
+    if not context.config.stream_responses:
+        response, shared = await flights.do(origin_flight_key(key, http), lambda: fetch_and_store_async(http, key, context))
+        if shared and not shared_response_matches(key, http, response):
+            response = await fetch_and_store_async(http, key, context)
+        await send_to_client_async(writer, rewriter, response)
+        return
+    response, shared = await flights.do(origin_flight_key(key, http), lambda: fetch_and_store_async(http, key, context, writer, rewriter))
+    if not shared:
+        return
+    if response is None or not shared_response_matches(key, http, response):
+        await fetch_and_store_async(http, key, context, writer, rewriter)
+        return
+    await send_to_client_async(writer, rewriter, response)
+
+#coroutine version of handle_client
+async def handle_client_async(reader : asyncio.StreamReader, writer : asyncio.StreamWriter, context : ProxyContext):
+    config = context.config
+    address = writer.get_extra_info("peername")
+    served = 0
+    metrics.inc("proxy_active_connections")
+    try:
+        while served < config.client_max_requests:
+            head = await read_request_head_async(reader, config.client_idle_timeout, config.client_header_timeout)
+            if head is None:
+                break
+            served += 1
+            last = served >= config.client_max_requests
+            if not await serve_client_request_async(writer, context, address, head, last, reader):
+                break
+    except ProxyTimeout as e:
+        try:
+            await send_timeout_response_async(writer, address, None, e, time.perf_counter())
+        except OSError:
+            pass
+    except OSError as e:
+        log.warning("Client %s failed: %s", address, e)
+    finally:
+        writer.close()
+        metrics.inc("proxy_active_connections", -1)
+
+#coroutine version of serve_client_request
+async def serve_client_request_async(writer : asyncio.StreamWriter, context : ProxyContext, address, head, last, reader : asyncio.StreamReader = None):
+    started = time.perf_counter()
+    if isinstance(head, HttpErrorResponse):
+        http = head
+    else:
+        http = http_request_pipeline(address, head)
+        metrics.observe("proxy_request_parse_seconds", time.perf_counter() - started)
+    if isinstance(http, HttpErrorResponse):
+        error_string = http.to_http_string()
+        error_bytes = http.to_byte_array(error_string)
+        writer.write(error_bytes)
+        await writer.drain()
+        count_error_response(http.code)
+        log_access(address, None, http.code, len(error_bytes), "-", started)
+        return False
+    if http.method == "CONNECT":
+        return await serve_tunnel_async(reader, writer, context, address, http, started)
+    byte_range, if_range = take_byte_range(http, context.config)
+    rewriter = ClientResponseRewriter(client_wants_keep_alive(http) and not last, http.method, context.compressor is not None,
+                                      byte_range, if_range, http.http_version == "HTTP/1.0")
+    key = request_cache_key(context, get_cache_key(http, context.config), http)
+    # ranges are served from the identity response
+    encodings = [] if byte_range is not None else accepted_encodings(http.headers.get("Accept-Encoding"))
+    cache_status = "hit"
+    try:
+        response = None
+        stored = None
+        if http.method not in BODY_METHODS:
+            response = lookup_response(context.cache, key, encodings)
+            if response is None and context.disk_cache is not None:
+                stored = context.disk_cache.get(key)
+        if http.method in BODY_METHODS:
+            cache_status = "bypass"
+            await forward_upload_async(http, context, reader, writer, rewriter)
+        elif response is not None:
+            try:
+                await send_to_client_async(writer, rewriter, response)
+            finally:
+                context.cache.release(response)
+        elif stored is not None:
+            cache_status = "disk"
+            await send_stored_response_async(writer, rewriter, stored)
+        else:
+            stale = context.cache.get_stale(key)
+            if stale is None:
+                cache_status = "miss"
+                await serve_from_origin_async(http, key, context, writer, rewriter)
+            else:
+                try:
+                    cache_status = await serve_stale_async(http, key, context, writer, rewriter, stale)
+                finally:
+                    context.cache.release(stale[0])
+    except ProxyTimeout as e:
+        if rewriter.head_done:
+            log.warning("Response to %s cut: %s", address, e)
+            return False
+        await send_timeout_response_async(writer, address, http, e, started)
+        return False
+    except (OSError, ValueError) as e:
+        # the origin refused the connection, broke it or sent a malformed response
+        if rewriter.head_done:
+            log.warning("Response to %s cut: %s", address, e)
+            return False
+        log.warning("Origin of %s failed: %s", http.requested_host, e)
+        await send_error_response_async(writer, address, http, HttpErrorResponse(502, "Bad Gateway"), started)
+        return False
+    pending = rewriter.flush()
+    if len(pending) > 0:
+        writer.write(pending)
+        await writer.drain()
+    request_compression(context, http, key, encodings, rewriter)
+    count_served_request(cache_status, rewriter, byte_range is not None)
+    log_access(address, http, rewriter.code, rewriter.sent_bytes,
+               cache_status, started)
+    return rewriter.keep_alive
+
+#forks config.workers workers and keeps that many running until SIGTERM/SIGINT, serves their merged metrics
+def run_supervisor(proxy_port_number, config : ProxyConfig):
+    setup_logging(config)
+    log.info("Starting %d workers on port: %s", config.workers, proxy_port_number)
+    workers = {}
+    workers_lock = threading.Lock()
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    metrics.add_collector(lambda: [("proxy_workers", (), len(workers))])
+    if config.shared_cache_file:
+        # lays the file out before the workers open it, and reports its size
+        shared_cache = create_response_cache(config)
+        metrics.add_collector(lambda: [("proxy_cache_entries", (), shared_cache.stats()["entries"]),
+                                       ("proxy_cache_bytes", (), shared_cache.stats()["bytes"])])
+    for index in range(config.workers):
+        spawn_worker(index, proxy_port_number, config, workers, workers_lock)
+    setup_metrics_socket(config, lambda: render_worker_metrics(workers, workers_lock))
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        with workers_lock:
+            worker = workers.pop(pid, None)
+        if worker is None:
+            continue
+        worker.control_socket.close()
+        if stopping:
+            continue
+        log.warning("Worker %d (pid %d) exited with code %s, restarting it",
+                    worker.index, pid, os.waitstatus_to_exitcode(status))
+        metrics.inc("proxy_worker_restarts_total")
+        # a worker dying right after starting (e.g. the port is taken) would otherwise fork in a loop
+        if time.monotonic() - worker.started_at < 10.0:
+            time.sleep(config.worker_restart_delay)
+        if not stopping:
+            spawn_worker(worker.index, proxy_port_number, config, workers, workers_lock)
+    log.info("All workers stopped")
+
+#forks one worker, the child never returns from here
+def spawn_worker(index, proxy_port_number, config : ProxyConfig, workers, workers_lock):
+    supervisor_end, worker_end = socket.socketpair()
+    pid = os.fork()
+    if pid == 0:
+        supervisor_end.close()
+        code = 0
+        try:
+            run_worker(index, proxy_port_number, config, worker_end,
+                       [worker.control_socket for worker in workers.values()])
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        finally:
+            os._exit(code)
+    worker_end.close()
+    with workers_lock:
+        workers[pid] = WorkerProcess(index, pid, supervisor_end)
+
+#runs in the forked worker: drops the supervisor's handlers, logging and metrics, then runs the engine
+def run_worker(index, proxy_port_number, config : ProxyConfig, control_socket : socket, inherited_sockets):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    for inherited_socket in inherited_sockets:
+        inherited_socket.close()
+    # the log writer and metrics threads of the supervisor don't exist in the child
+    metrics.reset()
+    log.handlers.clear()
+    access_log.handlers.clear()
+    setup_logging(config)
+    if config.disk_cache_dir:
+        # a journal has a single writer, every worker keeps (and warms up from) its own
+        config.disk_cache_dir = os.path.join(config.disk_cache_dir, f"worker-{index}")
+    start_new_thread(do_worker_control_logic, (control_socket,))
+    log.info("Worker %d started, pid %d", index, os.getpid())
+    run_engine(proxy_port_number, config)
+
+#answers the supervisor's metrics requests, ends the worker once the supervisor is gone
+def do_worker_control_logic(control_socket : socket):
+    while True:
+        request = control_socket.recv(1)
+        if len(request) == 0:
+            os._exit(1)
+        data = pickle.dumps(metrics.snapshot())
+        control_socket.sendall(struct.pack("!I", len(data)) + data)
+
+#reads exactly size bytes from a socket
+def recv_exactly(sock : socket, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if len(chunk) == 0:
+            raise ConnectionError("connection closed")
+        data += chunk
+    return bytes(data)
+
+#the supervisor's metrics merged with a snapshot from every worker
+def render_worker_metrics(workers, workers_lock):
+    with workers_lock:
+        current = [worker for worker in workers.values() if worker.responsive]
+    snapshots = []
+    for worker in current:
+        try:
+            worker.control_socket.settimeout(2.0)
+            worker.control_socket.sendall(b"s")
+            (size,) = struct.unpack("!I", recv_exactly(worker.control_socket, 4))
+            snapshots.append(pickle.loads(recv_exactly(worker.control_socket, size)))
+        except OSError as e:
+            # a late answer would be taken for the next one, stop asking this worker
+            worker.responsive = False
+            log.warning("Worker %d didn't send its metrics: %s", worker.index, e)
+    return metrics.render(snapshots)
+
+#Http's Highlevel method, everything concerning Validation, parsing, sanitizing is put here, returns HTTPRequestInfo in the end to be used to send TCP to needed website
+#Returns HTTPErrorResponse object if not valid using validity local variable
+def http_request_pipeline(source_addr, http_raw_data):
+    """
+#Returns HTTPErrorResponse object if not valid using validity local variable
+
+    - Validates the given HTTP request and returns
+      an error if an invalid request was given.
+    - Parses it
+    - Returns a sanitized HttpRequestInfo
+
+    http_raw_data can be a str or the raw bytes, validation
+    and parsing are done in the same single pass.
+
+    returns:
+     HttpRequestInfo if the request was parsed correctly.
+     HttpErrorResponse if the request was invalid.
+
+    Please don't remove this function, but feel
+    free to change its content
+    """
+    validity, httprequest = parse_request_head(source_addr, raw_request_head(http_raw_data))
+    return pipeline_result(validity, httprequest)
+
+#maps the validity of a parsed request to the request itself or the error to answer with
+def pipeline_result(validity, httprequest):
+    if(validity == HttpRequestState.NOT_SUPPORTED):
+        code = 500
+        message = "Not supported"
+        return HttpErrorResponse(code,message)
+    elif(validity != HttpRequestState.GOOD):
+        code = 400
+        message = "Bad Request"
+        return HttpErrorResponse(code, message)
+    return httprequest
+
+#the request head as bytes, without the empty line(s) closing it
+def raw_request_head(http_raw_data):
+    if isinstance(http_raw_data, str):
+        http_raw_data = http_raw_data.encode("utf-8")
+    return bytes(http_raw_data).rstrip(b"\r\n")
+
+#parses the contents of an http request, and returns an HTTP Request Object
+def parse_http_request(source_addr, http_raw_data):
+    """
+    This function parses a "valid" HTTP request into an HttpRequestInfo
+    object.
+    """
+    validity, httprequest = parse_request_head(source_addr, raw_request_head(http_raw_data))
+    return httprequest
+
+#Checks the http request if it is a valid request
+def check_http_request_validity(http_raw_data) -> HttpRequestState:
+    """
+    Checks if an HTTP request is valid
+
+    returns:
+    One of values in HttpRequestState
+    """
+    validity, httprequest = parse_request_head(None, raw_request_head(http_raw_data))
+    return validity
+
+#methods we understand, HEAD is not served so far
+KNOWN_METHODS = {"GET", "HEAD", "POST", "PUT", "CONNECT"}
+SUPPORTED_METHODS = {"GET", "POST", "PUT", "CONNECT"}
+
+#methods whose request body is streamed to the origin, their responses are never cached
+BODY_METHODS = {"POST", "PUT"}
+
+#validates and parses a request head (bytes, without the final empty line) in one pass
+def parse_request_head(source_addr, head):
+    """
+    returns:
+    (HttpRequestState, HttpRequestInfo) the request is None
+    when the state is INVALID_INPUT.
+    """
+    lines = head.lstrip(b"\r\n").split(b"\r\n")
+    first_line = lines[0].split(b" ")
+    if(len(first_line) != 3):
+        return (HttpRequestState.INVALID_INPUT, None)
+    try:
+        method = first_line[0].decode("ascii").upper()
+        url = first_line[1].decode("ascii")
+        httpversion = first_line[2].decode("ascii").upper()
+    except UnicodeDecodeError:
+        return (HttpRequestState.INVALID_INPUT, None)
+    if(method not in KNOWN_METHODS or len(url) == 0):
+        return (HttpRequestState.INVALID_INPUT, None)
+    if(httpversion != "HTTP/1.0" and httpversion != "HTTP/1.1"):
+        return (HttpRequestState.INVALID_INPUT, None)
+    headers = HttpHeaders()
+    host_header = None
+    for line in lines[1:]:
+        name, colon, value = line.partition(b":")
+        name = name.strip()
+        if(len(colon) == 0 or len(name) == 0):
+            return (HttpRequestState.INVALID_INPUT, None)
+        header = [name.decode("iso-8859-1"), value.strip().decode("iso-8859-1")]
+        if(host_header is None and header[0].lower() == "host"):
+            host_header = header[1]
+        headers.append(header)
+    if(method == "CONNECT"):
+        # authority-form "host:port", the port is mandatory
+        if(":" not in url.rpartition("]")[2]):
+            return (HttpRequestState.INVALID_INPUT, None)
+        path = ""
+        authority = url
+    elif(url.startswith('/')):
+        if(host_header is None or len(host_header) == 0):
+            return (HttpRequestState.INVALID_INPUT, None)
+        path = url
+        authority = host_header
+    else:
+        scheme, separator, rest = url.partition("://")
+        if(len(separator) == 0):
+            rest = url
+        authority, slash, path = rest.partition("/")
+        path = "/" + path
+    host, port = split_host_port(authority)
+    if(host is None):
+        return (HttpRequestState.INVALID_INPUT, None)
+    if(method in BODY_METHODS):
+        framing = request_body_framing(headers)
+        if(framing is None):
+            return (HttpRequestState.INVALID_INPUT, None)
+        if(framing == "chunked"):
+            # the chunked coding wins, a Content-Length next to it must not reach the origin
+            headers.remove_all("Content-Length")
+    httprequest = HttpRequestInfo(source_addr, method, host, port, path, headers, httpversion)
+    sanitize_http_request(httprequest)
+    if(method not in SUPPORTED_METHODS):
+        return (HttpRequestState.NOT_SUPPORTED, httprequest)
+    return (HttpRequestState.GOOD, httprequest)
+
+#how the end of a request body is found: "none", "chunked" or "length", None if the headers don't tell it reliably
+def request_body_framing(headers : HttpHeaders):
+    transfer_encoding = headers.get("Transfer-Encoding")
+    if(transfer_encoding is not None):
+        codings = [coding.strip().lower() for coding in transfer_encoding.split(",")]
+        return "chunked" if codings[-1] == "chunked" else None
+    content_lengths = set(value.strip() for value in headers.get_all("Content-Length"))
+    if(len(content_lengths) == 0):
+        return "none"
+    if(len(content_lengths) > 1 or not next(iter(content_lengths)).isdigit()):
+        return None
+    return "length"
+
+#splits "host[:port]" (host may be a [ipv6] literal), the port defaults to 80, (None, None) if invalid
+def split_host_port(authority):
+    if(authority.startswith("[")):
+        host, bracket, port = authority[1:].partition("]")
+        port = port[1:] if port.startswith(":") else ""
+    else:
+        host, colon, port = authority.partition(":")
+    host = host.lower()
+    if(len(host) == 0):
+        return (None, None)
+    if(len(port) == 0):
+        return (host, 80)
+    if(not port.isdigit() or not 0 < int(port) < 65536):
+        return (None, None)
+    return (host, int(port))
 
 #Sanitizing, making the HTTP request of the correct format, before sending to server
 def sanitize_http_request(request_info: HttpRequestInfo):
@@ -419,7 +4544,8 @@ def sanitize_http_request(request_info: HttpRequestInfo):
     returns:
     nothing, but modifies the input object
     """
-  
+    if(not request_info.headers.contains("Host")):
+        request_info.headers.insert(0, ["Host", request_info.host_header_value()])
 
 
 #######################################
@@ -0,0 +1,347 @@
+import sys
+import os
+import json
+import time
+import random
+import socket
+import argparse
+import threading
+import importlib.util
+import multiprocessing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+#######################################
+# Load-generation benchmark of the proxy.
+#
+# Starts a stand-in origin server and the proxy (through entry_point,
+# configured with PROXY_* environment variables), drives N concurrent
+# clients with a mix of requests and reports requests/sec, latency
+# percentiles, the cache hit ratio and the peak RSS of the proxy process.
+#
+# python benchmark.py --clients 50 --duration 10 --mix hit=70,miss=20,large=5,slow=5
+# python benchmark.py --clients 50 --set workers=4
+# python benchmark.py --mix hit=60,scan=40 --hot-set 1000 --zipf 1.0 --set cache_max_entries=200 --compare-admission
+#######################################
+
+PROXY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "4572_4725_lab2.py")
+REQUEST_KINDS = ("hit", "miss", "large", "slow", "scan")
+CACHEABLE_KINDS = ("hit", "large", "slow", "scan")
+
+
+#loads the proxy file as a module, its name can't be imported directly
+def load_proxy_module():
+    spec = importlib.util.spec_from_file_location("proxy_under_test", PROXY_FILE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+#stand-in origin, every path answers with a generated body
+class OriginHandler(BaseHTTPRequestHandler):
+    """
+    /hit/<n>: small cacheable body.
+    /miss/<n>: small body with Cache-Control: no-store.
+    /large/<n>: large cacheable body (server.large_body).
+    /scan/<n>: small cacheable body, each asked for only once.
+
+    server.origin_requests counts the requests of each kind.
+    """
+
+    protocol_version = "HTTP/1.1"
+    small_body = b"x" * 1024
+
+    def setup(self):
+        super().setup()
+        # headers and body are written separately, don't let Nagle delay the body
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_GET(self):
+        kind = self.path.split("/")[1]
+        with self.server.counts_lock:
+            self.server.origin_requests[kind] = self.server.origin_requests.get(kind, 0) + 1
+        if kind == "large":
+            body = self.server.large_body
+        else:
+            body = self.small_body
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(body)))
+        if kind == "miss":
+            self.send_header("Cache-Control", "no-store")
+        else:
+            self.send_header("Cache-Control", "max-age=3600")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+#starts the origin on a free port in a daemon thread
+def start_origin(large_size):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), OriginHandler)
+    server.daemon_threads = True
+    server.large_body = b"L" * large_size
+    server.origin_requests = {}
+    server.counts_lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+#runs in the proxy process
+def run_proxy(proxy_port, environ):
+    os.environ.update(environ)
+    sys.stdout = open(os.devnull, "w")
+    module = load_proxy_module()
+    module.entry_point(proxy_port)
+
+
+#finds a free local port for the proxy
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+#waits until something listens on the port
+def wait_for_port(port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1.0).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"nothing listening on port {port}")
+
+
+#peak resident memory (KiB) of a running process and its workers, None if /proc isn't available
+def peak_rss_kib(pid):
+    try:
+        total = 0
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    total += int(line.split()[1])
+        with open(f"/proc/{pid}/task/{pid}/children") as children:
+            for child in children.read().split():
+                total += peak_rss_kib(int(child)) or 0
+        return total
+    except OSError:
+        pass
+    return None
+
+
+#one request through the proxy, returns the number of bytes received
+def do_request(proxy_port, origin_port, path, slow):
+    request = (f"GET {path} HTTP/1.0\r\n"
+               f"Host: 127.0.0.1:{origin_port}\r\n\r\n").encode("ascii")
+    received = 0
+    with socket.create_connection(("127.0.0.1", proxy_port), timeout=30.0) as client:
+        client.sendall(request)
+        while True:
+            data = client.recv(16384 if slow else 65536)
+            if len(data) == 0:
+                break
+            received += len(data)
+            if slow:
+                time.sleep(0.005)
+    return received
+
+
+#returns a function picking one of the hot_set cacheable URLs, uniformly or Zipf-distributed with exponent zipf
+def hot_url_picker(hot_set, zipf):
+    if zipf <= 0:
+        return lambda: random.randrange(hot_set)
+    ranks = range(hot_set)
+    cum_weights = []
+    total = 0.0
+    for rank in ranks:
+        total += 1.0 / (rank + 1) ** zipf
+        cum_weights.append(total)
+    return lambda: random.choices(ranks, cum_weights=cum_weights)[0]
+
+
+#picks the path of a request of the given kind
+def request_path(kind, counter, pick_hot):
+    if kind == "hit" or kind == "slow":
+        return f"/hit/{pick_hot()}"
+    if kind == "large":
+        return f"/large/{pick_hot()}"
+    return f"/{kind}/{next(counter)}"
+
+
+#client thread: sends requests until the deadline, recording (kind, latency, ok)
+def client_loop(proxy_port, origin_port, mix, counter, pick_hot, deadline, results):
+    kinds = [kind for (kind, weight) in mix]
+    weights = [weight for (kind, weight) in mix]
+    while time.monotonic() < deadline:
+        kind = random.choices(kinds, weights)[0]
+        path = request_path(kind, counter, pick_hot)
+        start = time.perf_counter()
+        try:
+            ok = do_request(proxy_port, origin_port, path, kind == "slow") > 0
+        except OSError:
+            ok = False
+        results.append((kind, time.perf_counter() - start, ok))
+
+
+#value at percentile p of sorted values
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+#latency/throughput summary of a list of (kind, latency, ok)
+def summarize(results, elapsed):
+    latencies = sorted(latency for (kind, latency, ok) in results if ok)
+    summary = {
+        "requests": len(results),
+        "errors": sum(1 for (kind, latency, ok) in results if not ok),
+        "requests_per_sec": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+    return summary
+
+
+#share of the requests for cacheable URLs the proxy answered without asking the origin, None without any
+def hit_ratio(results, origin_requests):
+    requests = sum(1 for (kind, latency, ok) in results if ok and kind in CACHEABLE_KINDS)
+    if requests == 0:
+        return None
+    fetched = sum(origin_requests.get(kind, 0) for kind in CACHEABLE_KINDS)
+    # "slow" requests fetch /hit/ paths
+    return max(0.0, 1.0 - fetched / requests)
+
+
+#parses "hit=70,miss=20" into [("hit", 70), ("miss", 20)]
+def parse_mix(text):
+    mix = []
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in REQUEST_KINDS:
+            raise argparse.ArgumentTypeError(f"unknown request kind {kind!r}")
+        mix.append((kind, float(weight)))
+    return mix
+
+
+#parses "engine=asyncio" into {"PROXY_ENGINE": "asyncio"}
+def parse_proxy_settings(settings):
+    environ = {}
+    for setting in settings:
+        name, _, value = setting.partition("=")
+        environ["PROXY_" + name.strip().upper()] = value
+    return environ
+
+
+def run_benchmark(clients, duration, mix, hot_set, large_size, warmup, environ, zipf=0.0):
+    """
+    Runs one benchmark and returns its results as a dict.
+    """
+    pick_hot = hot_url_picker(hot_set, zipf)
+    origin = start_origin(large_size)
+    origin_port = origin.server_address[1]
+    proxy_port = free_port()
+    proxy = multiprocessing.Process(target=run_proxy, args=(proxy_port, environ), daemon=True)
+    proxy.start()
+    try:
+        wait_for_port(proxy_port)
+        counter = iter(range(1 << 62))
+        if warmup > 0:
+            client_loop(proxy_port, origin_port, mix, counter, pick_hot,
+                        time.monotonic() + warmup, [])
+        with origin.counts_lock:
+            origin.origin_requests.clear()
+        results = []
+        deadline = time.monotonic() + duration
+        threads = [threading.Thread(target=client_loop,
+                                    args=(proxy_port, origin_port, mix, counter,
+                                          pick_hot, deadline, results))
+                   for i in range(clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        report = summarize(results, elapsed)
+        with origin.counts_lock:
+            report["origin_requests"] = dict(origin.origin_requests)
+        report["hit_ratio"] = hit_ratio(results, report["origin_requests"])
+        report["peak_rss_kib"] = peak_rss_kib(proxy.pid)
+        report["by_kind"] = {kind: summarize([r for r in results if r[0] == kind], elapsed)
+                             for (kind, weight) in mix}
+    finally:
+        proxy.terminate()
+        proxy.join()
+        origin.shutdown()
+    report["settings"] = {"clients": clients, "duration": duration,
+                          "mix": dict(mix), "hot_set": hot_set, "zipf": zipf,
+                          "large_size": large_size, "environ": environ}
+    return report
+
+
+def display(report):
+    print(f"requests: {report['requests']}  errors: {report['errors']}")
+    print(f"requests/sec: {report['requests_per_sec']:.1f}")
+    print(f"latency p50/p95/p99 (ms): {report['p50_ms']:.2f} / "
+          f"{report['p95_ms']:.2f} / {report['p99_ms']:.2f}")
+    print(f"proxy peak RSS (KiB): {report['peak_rss_kib']}")
+    if report["hit_ratio"] is not None:
+        print(f"cache hit ratio: {report['hit_ratio']:.3f}  origin requests: {report['origin_requests']}")
+    for (kind, summary) in report["by_kind"].items():
+        print(f"  {kind:5} {summary['requests']:7} req  p50 {summary['p50_ms']:8.2f} ms"
+              f"  p99 {summary['p99_ms']:8.2f} ms  errors {summary['errors']}")
+
+
+#the same benchmark without and with cache admission, side by side
+def compare_admission(run):
+    reports = {}
+    for setting in ("0", "1"):
+        print(f"--- cache_admission={setting}")
+        reports[setting] = run({"PROXY_CACHE_ADMISSION": setting})
+        display(reports[setting])
+    print("--- hit ratio without / with admission: " +
+          " / ".join("n/a" if reports[setting]["hit_ratio"] is None else f"{reports[setting]['hit_ratio']:.3f}"
+                     for setting in ("0", "1")))
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-generation benchmark of the proxy.")
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--warmup", type=float, default=1.0, help="seconds")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("hit=70,miss=20,large=5,slow=5"))
+    parser.add_argument("--hot-set", type=int, default=100, help="distinct cacheable URLs")
+    parser.add_argument("--zipf", type=float, default=0.0,
+                        help="exponent of the Zipf popularity of the hot URLs, 0 for uniform")
+    parser.add_argument("--large-size", type=int, default=2 * 1024 * 1024, help="bytes")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                        help="proxy setting, e.g. --set engine=asyncio")
+    parser.add_argument("--compare-admission", action="store_true",
+                        help="run once without and once with cache admission and compare the hit ratios")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    environ = parse_proxy_settings(args.set)
+    run = lambda overrides: run_benchmark(args.clients, args.duration, args.mix, args.hot_set,
+                                          args.large_size, args.warmup, dict(environ, **overrides),
+                                          args.zipf)
+    if args.compare_admission:
+        report = compare_admission(run)
+    else:
+        report = run({})
+        display(report)
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
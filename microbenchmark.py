@@ -0,0 +1,164 @@
+import json
+import time
+import argparse
+import tracemalloc
+
+from benchmark import load_proxy_module
+
+#######################################
+# Micro-benchmarks of the request parsing pipeline.
+#
+# Times the parsing/serialization functions over a corpus of
+# realistic requests and reports ops/sec and the peak memory
+# traced by tracemalloc during one operation (bytes above what
+# was allocated before the call, not a count of allocations).
+# The JSON output of one run can be compared with another one
+# (e.g. from the previous commit):
+#
+# python microbenchmark.py --json before.json
+# python microbenchmark.py --compare before.json
+#######################################
+
+BROWSER_HEADERS = (
+    "User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/118.0\r\n"
+    "Accept: text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,*/*;q=0.8\r\n"
+    "Accept-Language: en-US,en;q=0.5\r\n"
+    "Accept-Encoding: gzip, deflate, br\r\n"
+    "Connection: keep-alive\r\n"
+    "Upgrade-Insecure-Requests: 1\r\n"
+)
+
+
+#the requests every benchmark runs over, as (name, raw request) pairs
+def build_corpus():
+    many_headers = "".join(f"X-Custom-Header-{i}: value-{i}-{'v' * 20}\r\n" for i in range(30))
+    long_query = "&".join(f"param{i}=value{i}" for i in range(150))
+    return [
+        ("absolute", "GET http://www.example.com/index.html HTTP/1.1\r\n"
+                     + BROWSER_HEADERS + "\r\n"),
+        ("absolute_port", "GET http://www.example.com:8080/a/b/c?x=1 HTTP/1.0\r\n"
+                          "Accept: */*\r\n\r\n"),
+        ("relative_host", "GET /static/app.js HTTP/1.1\r\nHost: cdn.example.com\r\n"
+                          + BROWSER_HEADERS + "\r\n"),
+        ("many_headers", "GET /api/items HTTP/1.1\r\nHost: api.example.com\r\n"
+                         + many_headers + "\r\n"),
+        ("long_url", f"GET http://search.example.com/q?{long_query} HTTP/1.1\r\n"
+                     + BROWSER_HEADERS + "\r\n"),
+    ]
+
+
+#the functions measured, each takes one raw request (str) and is prepared once per request
+def build_cases(proxy):
+    client_addr = ("127.0.0.1", 9877)
+
+    def pipeline(raw):
+        encoded = raw.encode("utf-8")
+        return lambda: proxy.http_request_pipeline(client_addr, encoded)
+
+    def parse_head(raw):
+        head = proxy.raw_request_head(raw)
+        return lambda: proxy.parse_request_head(client_addr, head)
+
+    def incremental_parser(raw):
+        encoded = raw.encode("utf-8")
+        def run():
+            parser = proxy.HttpRequestParser(client_addr)
+            parser.feed(encoded)
+            return parser.request
+        return run
+
+    def parse_http_request(raw):
+        return lambda: proxy.parse_http_request(client_addr, raw)
+
+    def to_http_string(raw):
+        request = proxy.parse_http_request(client_addr, raw)
+        return request.to_http_string
+
+    def to_bytes(raw):
+        request = proxy.parse_http_request(client_addr, raw)
+        return request.to_keep_alive_bytes
+
+    return [
+        ("http_request_pipeline", pipeline),
+        ("parse_request_head", parse_head),
+        ("HttpRequestParser.feed", incremental_parser),
+        ("parse_http_request", parse_http_request),
+        ("HttpRequestInfo.to_http_string", to_http_string),
+        ("HttpRequestInfo.to_keep_alive_bytes", to_bytes),
+    ]
+
+
+#ops/sec of fn, best of repeat rounds of number calls
+def time_ops(fn, number, repeat):
+    best = float("inf")
+    for i in range(repeat):
+        start = time.perf_counter()
+        for j in range(number):
+            fn()
+        best = min(best, time.perf_counter() - start)
+    return number / best
+
+
+#peak traced bytes above the starting point during one call of fn, averaged over number calls
+def peak_traced_bytes(fn, number):
+    tracemalloc.start()
+    try:
+        total = 0
+        for i in range(number):
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            fn()
+            total += tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+    return total / number
+
+
+def run(number, repeat):
+    proxy = load_proxy_module()
+    corpus = build_corpus()
+    results = {}
+    for (case_name, prepare) in build_cases(proxy):
+        for (request_name, raw) in corpus:
+            fn = prepare(raw)
+            results[f"{case_name}[{request_name}]"] = {
+                "ops_per_sec": time_ops(fn, number, repeat),
+                "peak_traced_bytes_per_op": peak_traced_bytes(fn, max(1, number // 10)),
+            }
+    return results
+
+
+def display(results, baseline=None):
+    for (name, result) in results.items():
+        line = (f"{name:58} {result['ops_per_sec']:12.0f} ops/s "
+                f"{result['peak_traced_bytes_per_op']:9.0f} peak B/op")
+        if baseline is not None and name in baseline:
+            before = baseline[name]
+            # files written before the field was renamed
+            before_bytes = before.get("peak_traced_bytes_per_op", before.get("peak_bytes_per_op", 0.0))
+            line += (f"   x{result['ops_per_sec'] / before['ops_per_sec']:.2f} speed"
+                     f"  x{result['peak_traced_bytes_per_op'] / max(1.0, before_bytes):.2f} peak bytes")
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the request parsing pipeline.")
+    parser.add_argument("--number", type=int, default=2000, help="calls per timing round")
+    parser.add_argument("--repeat", type=int, default=5, help="timing rounds, the best one counts")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="results file of an earlier run to compare with")
+    args = parser.parse_args()
+
+    results = run(args.number, args.repeat)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as previous:
+            baseline = json.load(previous)
+    display(results, baseline)
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()